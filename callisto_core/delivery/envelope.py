@@ -0,0 +1,211 @@
+"""
+
+Record data is serialized into a self describing envelope before it is
+encrypted:
+
+    ENVELOPE_MARKER
+    the envelope version (1 byte)
+    the codec (1 byte)
+    the compression (1 byte)
+    the schema ref length (1 byte), then the schema ref (ascii)
+    the compressed, serialized record data
+
+Version 1 envelopes end after the compression byte, and are always JSON.
+
+Encrypted bytes don't compress, so this is the last chance to shrink
+records before they reach the database. Records repeat a lot of question
+text, and compress several times over.
+
+Configure envelopes with:
+
+    RECORD_CODEC = "json"  # or "msgpack", which requires msgpack
+    RECORD_COMPRESSION = "zlib"  # or "zstd", which requires zstandard
+
+Payloads from before envelopes are plain JSON (or plain text) and are
+read as they always were.
+
+"""
+import json
+import zlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# never the first byte of JSON, or of the plain text in the oldest records
+ENVELOPE_MARKER = b"\x00"
+ENVELOPE_VERSION = 2
+CODEC_JSON = 1
+CODEC_MSGPACK = 2
+CODECS = {"json": CODEC_JSON, "msgpack": CODEC_MSGPACK}
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+COMPRESSIONS = {"zlib": COMPRESSION_ZLIB, "zstd": COMPRESSION_ZSTD}
+CHUNK_SIZE = 64 * 1024
+
+Header = namedtuple("Header", ["version", "codec", "compression", "schema_ref"])
+
+
+def dump_record(record_data, schema_ref="", codec=None, compression=None):
+    """
+    Serializes and compresses record data, a chunk at a time. The codec and
+    compression names default to the RECORD_CODEC and RECORD_COMPRESSION
+    settings. The schema ref names the form schema the record was answered
+    against.
+
+    Yields:
+      bytes: the envelope header, then chunks of compressed record data
+
+    """
+    codec = _lookup(
+        CODECS, "RECORD_CODEC", codec or getattr(settings, "RECORD_CODEC", "json")
+    )
+    compression = _lookup(
+        COMPRESSIONS,
+        "RECORD_COMPRESSION",
+        compression or getattr(settings, "RECORD_COMPRESSION", "zlib"),
+    )
+    compressor = _compressor(compression)
+    schema_ref = schema_ref.encode("ascii")
+    yield ENVELOPE_MARKER + bytes(
+        [ENVELOPE_VERSION, codec, compression, len(schema_ref)]
+    ) + schema_ref
+    for chunk in _serialized_chunks(codec, record_data):
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def load_record(chunks):
+    """
+    Loads record data from the byte chunks of a decrypted payload, with or
+    without an envelope
+
+    Returns:
+      tuple: the envelope Header, or None for payloads from before envelopes,
+        and the record data (str for records stored as plain text)
+
+    """
+    chunks = iter(chunks)
+    leading = _read_leading(chunks)
+    header, body_start = read_header(leading)
+    if header is None:
+        return None, _load_legacy(leading + b"".join(chunks))
+    # only the decompressed body is ever held whole, never the payload
+    decompressor = _decompressor(header.compression)
+    body = bytearray(decompressor.decompress(leading[body_start:]))
+    for chunk in chunks:
+        body += decompressor.decompress(chunk)
+    body += decompressor.flush()
+    if header.codec == CODEC_JSON:
+        return header, json.loads(body)
+    elif header.codec == CODEC_MSGPACK:
+        return header, _msgpack().unpackb(body, raw=False)
+    raise ValueError("Unknown record codec {}".format(header.codec))
+
+
+def read_header(payload):
+    """
+    Returns:
+      tuple: the envelope Header, or None, and the offset the body starts at
+
+    """
+    if not is_envelope(payload):
+        return None, 0
+    version = payload[1]
+    if version == 1:
+        return Header(version, CODEC_JSON, payload[2], ""), 3
+    elif version == ENVELOPE_VERSION:
+        codec, compression, ref_length = payload[2], payload[3], payload[4]
+        schema_ref = bytes(payload[5 : 5 + ref_length]).decode("ascii")
+        return Header(version, codec, compression, schema_ref), 5 + ref_length
+    raise ValueError("Unknown record envelope version {}".format(version))
+
+
+def is_envelope(payload):
+    return bytes(payload[:1]) == ENVELOPE_MARKER
+
+
+def _read_leading(chunks):
+    """reads chunks until the leading bytes hold a whole envelope header"""
+    leading = b""
+    for chunk in chunks:
+        leading += bytes(chunk)
+        if not is_envelope(leading) or len(leading) >= _header_length(leading):
+            break
+    return leading
+
+
+def _header_length(leading):
+    if len(leading) < 2:
+        return 2
+    elif leading[1] == 1:
+        return 3
+    elif len(leading) < 5:
+        return 5
+    return 5 + leading[4]
+
+
+def _load_legacy(payload):
+    text = payload.decode("utf-8")
+    try:
+        return json.loads(text)
+    except json.decoder.JSONDecodeError:
+        return text
+
+
+def _serialized_chunks(codec, record_data):
+    if codec == CODEC_MSGPACK:
+        yield _msgpack().packb(record_data, use_bin_type=True)
+        return
+    # json.dumps runs in C, where iterencode would run in python
+    serialized = memoryview(json.dumps(record_data).encode("utf-8"))
+    for start in range(0, len(serialized), CHUNK_SIZE):
+        yield serialized[start : start + CHUNK_SIZE]
+
+
+def _lookup(values, setting, name):
+    try:
+        return values[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            "Unknown {} {}, use one of {}".format(setting, name, ", ".join(values))
+        )
+
+
+def _compressor(compression):
+    if compression == COMPRESSION_ZSTD:
+        return _optional(zstandard, "zstd compressed").ZstdCompressor().compressobj()
+    return zlib.compressobj()
+
+
+def _decompressor(compression):
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompressobj()
+    elif compression == COMPRESSION_ZSTD:
+        return (
+            _optional(zstandard, "zstd compressed").ZstdDecompressor().decompressobj()
+        )
+    raise ValueError("Unknown record compression {}".format(compression))
+
+
+def _msgpack():
+    return _optional(msgpack, "msgpack encoded")
+
+
+def _optional(module, description):
+    if module is None:
+        raise ImproperlyConfigured(
+            "{} records require an optional package, "
+            "see callisto_core.delivery.envelope".format(description)
+        )
+    return module
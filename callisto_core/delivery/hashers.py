@@ -1,10 +1,18 @@
 import base64
+import contextlib
+import functools
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import argon2
 
 from django.conf import settings
 from django.contrib.auth.hashers import BasePasswordHasher, PBKDF2PasswordHasher
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_finished, request_started, setting_changed
 from django.utils.encoding import force_bytes
 from django.utils.module_loading import import_string
 
@@ -12,6 +20,7 @@ from django.utils.module_loading import import_string
 # Portions of the below implementation are copyright the Django Software Foundation and individual contributors, and
 # are under the BSD-3 Clause License:
 # https://github.com/django/django/blob/master/LICENSE
+@functools.lru_cache()
 def get_hashers():
     hashers = []
     for hasher_path in settings.KEY_HASHERS:
@@ -25,6 +34,7 @@ def get_hashers():
     return hashers
 
 
+@functools.lru_cache()
 def get_hashers_by_algorithm():
     hashers = get_hashers()
     return {hasher.algorithm: hasher for hasher in hashers}
@@ -58,27 +68,221 @@ def identify_hasher(encoded):
     return get_hasher(algorithm)
 
 
-def make_key(encode_prefix, key, salt):
-    iterations = None
+HASHER_SETTINGS = {
+    "KEY_HASHERS",
+    "KEY_ITERATIONS",
+    "ORIGINAL_KEY_ITERATIONS",
+    "ARGON2_TIME_COST",
+    "ARGON2_MEM_COST",
+    "ARGON2_PARALLELISM",
+}
+
+
+KDF_EXECUTOR_SETTINGS = {
+    "KDF_WORKERS",
+    "KDF_QUEUE_DEPTH",
+    "KDF_MEMORY_BUDGET",
+    "KDF_RETRY_AFTER",
+}
+
+
+def reset_hashers(**kwargs):
+    """
+    hashers are built once, and rebuilt when a setting they depend on
+    changes (ie. under override_settings)
+    """
+    if kwargs["setting"] in HASHER_SETTINGS:
+        get_hashers.cache_clear()
+        get_hashers_by_algorithm.cache_clear()
+    if kwargs["setting"] in KDF_EXECUTOR_SETTINGS:
+        reset_kdf_executor()
+
+
+setting_changed.connect(reset_hashers, dispatch_uid="callisto_core_reset_hashers")
+
+
+class KeyDerivationBusy(Exception):
+    """raised instead of queueing a key derivation behind too many others"""
+
+    def __init__(self, retry_after):
+        super().__init__(
+            "too many key derivations in progress, retry after {}s".format(retry_after)
+        )
+        self.retry_after = retry_after
+
+
+class KeyDerivationExecutor(object):
+    """
+    Runs key derivations on a thread pool shared by every request thread.
+    Argon2 and PBKDF2 release the GIL while stretching, so threads run them
+    in parallel. The pool bounds the memory in use by Argon2 derivations.
+
+    At most queue_depth derivations wait for a thread, further derivations
+    fail fast with KeyDerivationBusy. Derivations only start while the
+    memory (in KiB) reserved by those running fits within memory_budget.
+    """
+
+    def __init__(self, workers, queue_depth, memory_budget=None, retry_after=5):
+        self.memory_budget = memory_budget
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="callisto_core_kdf"
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._memory = threading.Condition()
+        self._memory_in_use = 0
+
+    def run(self, memory_kib, func, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise KeyDerivationBusy(self.retry_after)
+        try:
+            return self._executor.submit(
+                self._derive, memory_kib, func, *args, **kwargs
+            ).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        """lets running derivations finish, then stops the pool's threads"""
+        self._executor.shutdown(wait=False)
+
+    def _derive(self, memory_kib, func, *args, **kwargs):
+        with self._reserve(memory_kib):
+            return func(*args, **kwargs)
+
+    @contextlib.contextmanager
+    def _reserve(self, memory_kib):
+        if self.memory_budget:
+            # a derivation larger than the budget runs alone
+            memory_kib = min(memory_kib, self.memory_budget)
+        with self._memory:
+            self._memory.wait_for(
+                lambda: not self.memory_budget
+                or self._memory_in_use + memory_kib <= self.memory_budget
+            )
+            self._memory_in_use += memory_kib
+        try:
+            yield
+        finally:
+            with self._memory:
+                self._memory_in_use -= memory_kib
+                self._memory.notify_all()
+
+
+@functools.lru_cache()
+def get_kdf_executor():
+    return KeyDerivationExecutor(
+        workers=getattr(settings, "KDF_WORKERS", 4),
+        queue_depth=getattr(settings, "KDF_QUEUE_DEPTH", 16),
+        memory_budget=getattr(settings, "KDF_MEMORY_BUDGET", None),
+        retry_after=getattr(settings, "KDF_RETRY_AFTER", 5),
+    )
+
+
+def reset_kdf_executor():
+    """shuts down the current executor, the next one is built on first use"""
+    if get_kdf_executor.cache_info().currsize:
+        get_kdf_executor().shutdown()
+    get_kdf_executor.cache_clear()
+
+
+# the pool's threads don't survive a fork, ie. into a matching worker process
+os.register_at_fork(after_in_child=get_kdf_executor.cache_clear)
+
+
+def current_prefix():
+    """
+    The start of the encode prefix, up to the salt, that keys stretched
+    with the default hasher and the current parameters get
+    """
+    return get_hasher().parameters_prefix()
+
+
+def must_update(encode_prefix):
+    """
+    Whether a key stretched against this encode prefix was stretched by
+    another hasher, or with parameters other than the current ones
+    """
+    return not (encode_prefix or "").startswith(current_prefix())
+
+
+KeyParameters = namedtuple("KeyParameters", ["hasher", "salt", "options", "harden"])
+
+
+def key_parameters(encode_prefix, salt):
+    """
+    Parses an encode prefix (or a legacy salt) into the parameters needed to
+    stretch keys against it. Parse once when stretching several keys
+    against the same prefix.
+    """
+    options = {}
     hasher = identify_hasher(encode_prefix)
 
     if not encode_prefix:
         assert salt is not None
-        iterations = settings.ORIGINAL_KEY_ITERATIONS
+        options["iterations"] = settings.ORIGINAL_KEY_ITERATIONS
     else:
         salt = encode_prefix.rsplit("$", 1)[1]
 
     if encode_prefix and hasher.algorithm == "pbkdf2_sha256":
-        iterations = encode_prefix.split("$")[1]
+        options["iterations"] = int(encode_prefix.split("$")[1])
+    elif encode_prefix and hasher.algorithm == "argon2":
+        options = hasher.prefix_options(encode_prefix)
+
+    harden = hasher.algorithm == "pbkdf2_sha256" and hasher.must_update(encode_prefix)
+    return KeyParameters(hasher, salt, options, harden)
 
-    encoded = hasher.encode(key, salt, iterations=iterations)
-    if hasher.algorithm == "pbkdf2_sha256" and hasher.must_update(encode_prefix):
+
+def stretch_key(parameters, key):
+    hasher = parameters.hasher
+    encoded = hasher.encode(key, parameters.salt, **parameters.options)
+    if parameters.harden:
         hasher.harden_runtime(key, encoded)
 
     prefix, key = hasher.split_encoded(encoded)
     return prefix, key
 
 
+def make_key(encode_prefix, key, salt):
+    """
+    Stretches a key against an encode prefix (or a legacy salt). While a
+    request is being handled, the stretched key is remembered until the
+    response finishes, so the request only stretches each key once.
+    """
+    memo = getattr(_request_keys, "memo", None)
+    if memo is None:
+        return stretch_key(key_parameters(encode_prefix, salt), key)
+    memo_key = _memo_key(encode_prefix, salt, key)
+    if memo_key not in memo:
+        memo[memo_key] = stretch_key(key_parameters(encode_prefix, salt), key)
+    return memo[memo_key]
+
+
+def remember_key(encode_prefix, key, stretched_key):
+    """remembers a key just stretched against a new encode prefix, see make_key"""
+    memo = getattr(_request_keys, "memo", None)
+    if memo is not None:
+        memo[_memo_key(encode_prefix, None, key)] = (encode_prefix, stretched_key)
+
+
+def start_key_memo(**kwargs):
+    _request_keys.memo = {}
+
+
+def clear_key_memo(**kwargs):
+    _request_keys.memo = None
+
+
+def _memo_key(encode_prefix, salt, key):
+    # the key itself is never kept, only its digest
+    return (encode_prefix or "", salt or "", hashlib.sha256(force_bytes(key)).digest())
+
+
+_request_keys = threading.local()
+request_started.connect(start_key_memo, dispatch_uid="callisto_core_start_key_memo")
+request_finished.connect(clear_key_memo, dispatch_uid="callisto_core_clear_key_memo")
+
+
 class PBKDF2KeyHasher(PBKDF2PasswordHasher):
     """
     Key stretching using Django's PBKDF2 + SHA256 implementation.
@@ -86,7 +290,12 @@ class PBKDF2KeyHasher(PBKDF2PasswordHasher):
     Iterations may be changed safely in settings.
     """
 
-    iterations = settings.KEY_ITERATIONS
+    @property
+    def iterations(self):
+        return settings.KEY_ITERATIONS
+
+    def encode(self, password, salt, iterations=None):
+        return get_kdf_executor().run(0, super().encode, password, salt, iterations)
 
     def must_update(self, encode_prefix):
         if not encode_prefix:
@@ -95,6 +304,9 @@ class PBKDF2KeyHasher(PBKDF2PasswordHasher):
             algorithm, iterations, salt = encode_prefix.split("$", 2)
         return int(iterations) != self.iterations
 
+    def parameters_prefix(self):
+        return "{}${}$".format(self.algorithm, self.iterations)
+
     def split_encoded(self, encoded):
         """
         Splits the encoded string into a separate prefix and stretched key.
@@ -117,21 +329,34 @@ class Argon2KeyHasher(BasePasswordHasher):
     algorithm = "argon2"
     library = "argon2"
 
-    time_cost = settings.ARGON2_TIME_COST
-    memory_cost = settings.ARGON2_MEM_COST
-    parallelism = settings.ARGON2_PARALLELISM
+    @property
+    def time_cost(self):
+        return settings.ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.ARGON2_MEM_COST
+
+    @property
+    def parallelism(self):
+        return settings.ARGON2_PARALLELISM
 
     # accept **kwargs to allow a single encode statement across different
     # hashers
-    def encode(self, key, salt, **kwargs):
+    def encode(
+        self, key, salt, time_cost=None, memory_cost=None, parallelism=None, **kwargs
+    ):
         assert key is not None
         assert salt and "$" not in salt
-        data = argon2.low_level.hash_secret(
+        memory_cost = memory_cost or self.memory_cost
+        data = get_kdf_executor().run(
+            memory_cost,
+            argon2.low_level.hash_secret,
             force_bytes(key),
             force_bytes(salt),
-            time_cost=self.time_cost,
-            memory_cost=self.memory_cost,
-            parallelism=self.parallelism,
+            time_cost=time_cost or self.time_cost,
+            memory_cost=memory_cost,
+            parallelism=parallelism or self.parallelism,
             hash_len=32,
             type=argon2.low_level.Type.I,
         )
@@ -166,6 +391,29 @@ class Argon2KeyHasher(BasePasswordHasher):
             or self.parallelism != parallelism
         )
 
+    def prefix_options(self, encode_prefix):
+        """
+        The parameters a key was stretched with, to stretch keys against an
+        encode prefix from before the current parameters
+        """
+        _, _, _, time_cost, memory_cost, parallelism, _, _ = self._decode(
+            encode_prefix + "$"
+        )
+        return {
+            "time_cost": time_cost,
+            "memory_cost": memory_cost,
+            "parallelism": parallelism,
+        }
+
+    def parameters_prefix(self):
+        return "{}$argon2i$v={}$m={},t={},p={}$".format(
+            self.algorithm,
+            argon2.low_level.ARGON2_VERSION,
+            self.memory_cost,
+            self.time_cost,
+            self.parallelism,
+        )
+
     def harden_runtime(self, key, encoded):
         # The runtime for Argon2 is too complicated to implement a sensible
         # hardening algorithm.
@@ -0,0 +1,111 @@
+"""
+
+Compares record envelope codecs and compressions on the example records
+in callisto_core/tests/delivery/record_data.py, or on a JSON file of
+record data exported from your own install:
+
+    python manage.py benchmark_envelopes --copies 20
+    python manage.py benchmark_envelopes --records records.json
+
+Throughput is measured against the size of the records as plain JSON, so
+rows are comparable across codecs.
+
+"""
+import json
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+
+from callisto_core.delivery import envelope
+from callisto_core.delivery.utils import RecordDataUtil
+from callisto_core.tests.delivery import record_data
+
+
+class Command(BaseCommand):
+    help = "benchmarks record envelope codecs and compressions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=200)
+        parser.add_argument(
+            "--copies",
+            type=int,
+            default=1,
+            help="repeats the pages of each record, to benchmark longer records",
+        )
+        parser.add_argument(
+            "--records", default=None, help="a JSON file with a list of records"
+        )
+
+    def handle(self, *args, **options):
+        self.rounds = options["rounds"]
+        records = self._records(options["records"], options["copies"])
+        self.json_size = sum(
+            len(json.dumps(record).encode("utf-8")) for record in records
+        )
+        self.stdout.write(
+            f"{len(records)} records, {self.json_size} bytes as plain JSON, "
+            f"{self.rounds} rounds\n"
+        )
+        self.stdout.write(
+            f"  {'codec':<8} {'compression':<12} {'bytes':>9} {'ratio':>7} "
+            f"{'encode MB/s':>12} {'decode MB/s':>12}"
+        )
+        for codec in envelope.CODECS:
+            for compression in envelope.COMPRESSIONS:
+                self._benchmark(records, codec, compression)
+
+    def _records(self, path, copies):
+        if path:
+            with open(path) as records_file:
+                records = json.load(records_file)
+        else:
+            records = [
+                record_data.EXPECTED_SINGLE_LINE,
+                record_data.EXPECTED_SINGLE_RADIO,
+                record_data.EXPECTED_FORMSET,
+                RecordDataUtil.transform_if_old_format(
+                    record_data.EXAMPLE_FULL_DATASET
+                ),
+            ]
+        return [
+            dict(
+                record,
+                wizard_form_serialized=record.get("wizard_form_serialized", [])
+                * copies,
+            )
+            for record in records
+        ]
+
+    def _benchmark(self, records, codec, compression):
+        def dump():
+            return [
+                b"".join(
+                    envelope.dump_record(record, codec=codec, compression=compression)
+                )
+                for record in records
+            ]
+
+        try:
+            payloads = dump()
+        except ImproperlyConfigured:
+            self.stdout.write(f"  {codec:<8} {compression:<12} not installed")
+            return
+
+        def load():
+            for payload in payloads:
+                envelope.load_record([payload])
+
+        size = sum(len(payload) for payload in payloads)
+        self.stdout.write(
+            f"  {codec:<8} {compression:<12} {size:>9} "
+            f"{self.json_size / size:>7.1f} {self._throughput(dump):>12.1f} "
+            f"{self._throughput(load):>12.1f}"
+        )
+
+    def _throughput(self, func):
+        start = time.perf_counter()
+        for _ in range(self.rounds):
+            func()
+        seconds = time.perf_counter() - start
+        return self.json_size * self.rounds / seconds / 1e6
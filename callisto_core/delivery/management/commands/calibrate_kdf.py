@@ -0,0 +1,214 @@
+"""
+
+Benchmarks key stretching on this host, and suggests the ARGON2_* and
+KEY_ITERATIONS settings. Run it on the same hardware that serves requests
+and runs matching:
+
+    python manage.py calibrate_kdf --target-ms 250 --sweep-seconds 600
+
+Each parameter set is benchmarked in a fresh process, so the peak RSS
+reported for it is not inflated by the parameter sets before it.
+
+"""
+import math
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.crypto import get_random_string
+
+from callisto_core.delivery import hashers
+from callisto_core.delivery.models import MatchReport
+from callisto_core.reporting.matching import worker_count
+
+
+def _peak_rss():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024  # bytes on macOS, KiB everywhere else
+    return peak_rss
+
+
+def _benchmark(algorithm, options, samples):
+    """runs in a worker process, returns sorted timings in ms and RSS in KiB"""
+    hasher = hashers.get_hasher(algorithm)
+    baseline_rss = _peak_rss()
+    timings = []
+    for _ in range(samples):
+        salt = get_random_string()
+        start = time.perf_counter()
+        hasher.encode("calibration key", salt, **options)
+        timings.append((time.perf_counter() - start) * 1000)
+    peak_rss = _peak_rss()
+    return sorted(timings), peak_rss, peak_rss - baseline_rss
+
+
+def _percentile(timings, percent):
+    """nearest rank percentile of sorted timings"""
+    rank = math.ceil(percent / 100 * len(timings))
+    return timings[max(rank, 1) - 1]
+
+
+class Command(BaseCommand):
+    help = "benchmarks key stretching, and suggests KDF settings for this host"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target-ms",
+            type=float,
+            default=250,
+            help="the p95 latency a single key derivation should stay under",
+        )
+        parser.add_argument(
+            "--sweep-seconds",
+            type=float,
+            default=600,
+            help="how long matching one identifier should take at most",
+        )
+        parser.add_argument(
+            "--match-reports",
+            type=int,
+            default=None,
+            help="the MatchReport count to project sweeps for, defaults to the current count",
+        )
+        parser.add_argument("--samples", type=int, default=5)
+        parser.add_argument("--time-costs", type=int, nargs="+", default=[1, 2, 3, 4])
+        parser.add_argument(
+            "--memory-costs",
+            type=int,
+            nargs="+",
+            default=[settings.ARGON2_MEM_COST, 16384, 65536],
+            help="in KiB",
+        )
+        parser.add_argument(
+            "--parallelism", type=int, default=settings.ARGON2_PARALLELISM
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            nargs="+",
+            default=[settings.KEY_ITERATIONS, 100000, 300000, 600000],
+        )
+
+    def handle(self, *args, **options):
+        self.samples = options["samples"]
+        self.target_ms = options["target_ms"]
+        self.sweep_seconds = options["sweep_seconds"]
+        match_reports = options["match_reports"]
+        if match_reports is None:
+            match_reports = MatchReport.objects.count()
+        self.candidates = self._candidates_per_sweep(match_reports)
+        self.stdout.write(
+            f"Projecting sweeps over {match_reports} match reports, "
+            f"{self.candidates} of them in each identifier's bucket\n"
+        )
+
+        argon2_results = self._run(
+            "argon2",
+            [
+                {
+                    "time_cost": time_cost,
+                    "memory_cost": memory_cost,
+                    "parallelism": options["parallelism"],
+                }
+                for memory_cost in sorted(set(options["memory_costs"]))
+                for time_cost in sorted(set(options["time_costs"]))
+            ],
+        )
+        pbkdf2_results = self._run(
+            "pbkdf2_sha256",
+            [
+                {"iterations": iterations}
+                for iterations in sorted(set(options["iterations"]))
+            ],
+        )
+        self._suggest(argon2_results, pbkdf2_results)
+
+    def _candidates_per_sweep(self, match_reports):
+        """the match reports one identifier is tried against, see match_bucket"""
+        length = getattr(settings, "MATCH_BUCKET_LENGTH", 0)
+        return math.ceil(match_reports / 16 ** length)
+
+    def _workers(self, algorithm, options):
+        if algorithm == "argon2":
+            return worker_count(options["memory_cost"])
+        return max(1, getattr(settings, "MATCHING_WORKERS", 1))
+
+    def _run(self, algorithm, parameter_sets):
+        self.stdout.write(f"\n{algorithm}")
+        self.stdout.write(
+            f"  {'parameters':<44} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} "
+            f"{'peak KiB':>10} {'kdf KiB':>9} {'sweep s':>10}"
+        )
+        results = []
+        for options in parameter_sets:
+            # a new process per parameter set, since ru_maxrss only grows
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                timings, peak_rss, kdf_rss = executor.submit(
+                    _benchmark, algorithm, options, self.samples
+                ).result()
+            result = {
+                "options": options,
+                "p50": _percentile(timings, 50),
+                "p95": _percentile(timings, 95),
+                "max": timings[-1],
+                "peak_rss": peak_rss,
+                "kdf_rss": kdf_rss,
+            }
+            workers = self._workers(algorithm, options)
+            result["sweep"] = (
+                math.ceil(self.candidates / workers) * result["p50"] / 1000
+            )
+            results.append(result)
+            parameters = ",".join(f"{key}={value}" for key, value in options.items())
+            self.stdout.write(
+                f"  {parameters:<44} {result['p50']:>9.1f} {result['p95']:>9.1f} "
+                f"{result['max']:>9.1f} {peak_rss:>10} {kdf_rss:>9} "
+                f"{result['sweep']:>10.1f}"
+            )
+        return results
+
+    def _within_targets(self, results):
+        return [
+            result
+            for result in results
+            if result["p95"] <= self.target_ms and result["sweep"] <= self.sweep_seconds
+        ]
+
+    def _suggest(self, argon2_results, pbkdf2_results):
+        argon2 = self._strongest(
+            argon2_results,
+            lambda options: (
+                options["memory_cost"] * options["time_cost"],
+                options["memory_cost"],
+            ),
+        )
+        pbkdf2 = self._strongest(pbkdf2_results, lambda options: options["iterations"])
+        self.stdout.write(
+            f"\nSuggested settings, for a p95 under {self.target_ms:g} ms "
+            f"and sweeps under {self.sweep_seconds:g} s:"
+        )
+        if argon2:
+            self.stdout.write(f"    ARGON2_TIME_COST = {argon2['time_cost']}")
+            self.stdout.write(f"    ARGON2_MEM_COST = {argon2['memory_cost']}")
+            self.stdout.write(f"    ARGON2_PARALLELISM = {argon2['parallelism']}")
+        else:
+            self.stdout.write(
+                self.style.WARNING("    no argon2 parameters met both targets")
+            )
+        if pbkdf2:
+            self.stdout.write(f"    KEY_ITERATIONS = {pbkdf2['iterations']}")
+        else:
+            self.stdout.write(
+                self.style.WARNING("    no pbkdf2 parameters met both targets")
+            )
+
+    def _strongest(self, results, strength):
+        within_targets = self._within_targets(results)
+        if not within_targets:
+            return None
+        options = [result["options"] for result in within_targets]
+        return max(options, key=strength)
@@ -0,0 +1,21 @@
+"""
+
+Fails MatchingJobs that were queued more than MATCHING_JOB_EXPIRY_HOURS
+ago and never finished, and wipes the identifiers they hold. Jobs only
+clear their own identifiers once they run, so a lost task would otherwise
+keep them forever. Run it periodically, e.g. hourly from cron:
+
+    python manage.py expire_matching_jobs
+
+"""
+from django.core.management.base import BaseCommand
+
+from callisto_core.delivery.models import MatchingJob
+
+
+class Command(BaseCommand):
+    help = "fails unfinished MatchingJobs past MATCHING_JOB_EXPIRY_HOURS"
+
+    def handle(self, *args, **options):
+        expired = MatchingJob.objects.expire()
+        self.stdout.write(f"expired {expired} matching jobs")
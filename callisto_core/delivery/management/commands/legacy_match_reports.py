@@ -0,0 +1,24 @@
+"""
+
+Counts the MatchReports still on legacy or outdated key stretching
+parameters. Matching rehashes them as they are matched, so the count
+shows how far a change of KDF settings has rolled out:
+
+    python manage.py legacy_match_reports
+
+The count is a full scan of the MatchReport table, so it is kept out of
+the matching sweep.
+
+"""
+from django.core.management.base import BaseCommand
+
+from callisto_core.delivery.models import MatchReport
+
+
+class Command(BaseCommand):
+    help = "counts MatchReports on legacy or outdated key stretching parameters"
+
+    def handle(self, *args, **options):
+        legacy = MatchReport.objects.legacy().count()
+        total = MatchReport.objects.count()
+        self.stdout.write(f"{legacy} of {total} match reports are legacy")
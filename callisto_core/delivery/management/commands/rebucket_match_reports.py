@@ -0,0 +1,23 @@
+"""
+
+Brings MatchReport buckets to the current MATCH_BUCKET_LENGTH. Matching
+only looks in the current width's buckets, so run this after changing
+the setting:
+
+    python manage.py rebucket_match_reports
+
+Buckets are truncated when the width shrinks. When it grows they are
+cleared, and filled in again as the reports match.
+
+"""
+from django.core.management.base import BaseCommand
+
+from callisto_core.delivery.models import MatchReport
+
+
+class Command(BaseCommand):
+    help = "brings MatchReport buckets to the current MATCH_BUCKET_LENGTH"
+
+    def handle(self, *args, **options):
+        rebucketed = MatchReport.objects.rebucket()
+        self.stdout.write(f"rebucketed {rebucketed} match reports")
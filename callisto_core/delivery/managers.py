@@ -0,0 +1,150 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import Length, Substr
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from . import hashers, security
+
+
+class MatchReportQuerySet(QuerySet):
+    def in_bucket(self, identifier):
+        """
+        MatchReports that may have been encrypted with this identifier.
+
+        Includes rows in the identifier's bucket, and rows whose bucket has
+        not been filled in yet. Those rows get their bucket backfilled by
+        MatchReport.get_match. Rows bucketed at another width are left out,
+        see rebucket
+        """
+        return self.in_buckets([identifier])
+
+    def in_buckets(self, identifiers):
+        """MatchReports that may have been encrypted with any of these identifiers"""
+        buckets = {security.match_bucket(identifier) for identifier in identifiers}
+        if not buckets or None in buckets:
+            return self.all()
+        return self.filter(Q(bucket__in=buckets) | Q(bucket__isnull=True))
+
+    def rebucket(self):
+        """
+        Brings buckets computed at another MATCH_BUCKET_LENGTH to the current
+        width, so in_buckets can find them. Buckets are prefixes of the same
+        digest, so wider buckets are truncated. Narrower buckets can't be
+        widened without the identifier, so they're cleared, and backfilled
+        the next time they match
+
+        Returns the number of MatchReports rebucketed
+        """
+        length = getattr(settings, "MATCH_BUCKET_LENGTH", 0)
+        if not length:
+            return 0
+        stale = self.annotate(bucket_length=Length("bucket"))
+        return stale.filter(bucket_length__gt=length).update(
+            bucket=Substr("bucket", 1, length)
+        ) + stale.filter(bucket_length__lt=length).update(bucket=None)
+
+    def legacy(self):
+        """
+        MatchReports encrypted by another hasher, or with parameters other
+        than the current ones. Matching rehashes them as they are matched
+        """
+        return self.exclude(encode_prefix__startswith=hashers.current_prefix())
+
+    def with_match_found(self):
+        """
+        reads report.match_found in the same query, so MatchReport.match_found
+        doesn't need a query per row
+        """
+        return self.annotate(report_match_found=F("report__match_found"))
+
+
+class MatchingWatermarkQuerySet(QuerySet):
+    def for_identifiers(self, identifiers):
+        """
+        The watermark of each identifier, or a new unsaved watermark for
+        identifiers that have not been swept yet
+
+        Returns a dict of identifier => MatchingWatermark
+        """
+        digests = {
+            identifier: self.model.digest(identifier) for identifier in identifiers
+        }
+        existing = {
+            watermark.identifier_digest: watermark
+            for watermark in self.filter(identifier_digest__in=digests.values())
+        }
+        return {
+            identifier: existing.get(digest) or self.model(identifier_digest=digest)
+            for identifier, digest in digests.items()
+        }
+
+
+class MatchingJobQuerySet(QuerySet):
+    def expired(self):
+        """
+        Jobs still holding identifiers MATCHING_JOB_EXPIRY_HOURS after they
+        were queued, most likely because their task was lost
+        """
+        hours = getattr(settings, "MATCHING_JOB_EXPIRY_HOURS", 24)
+        return self.filter(
+            status__in=[self.model.PENDING, self.model.RUNNING],
+            created__lt=timezone.now() - timedelta(hours=hours),
+        )
+
+    def expire(self):
+        """
+        Fails expired jobs and wipes their identifiers
+
+        Returns the number of jobs expired
+        """
+        return self.expired().update(
+            status=self.model.FAILED, finished=timezone.now(), encrypted_identifiers=b""
+        )
+
+
+class FormSchemaSnapshotQuerySet(QuerySet):
+    ref_prefix = "sha256:"
+
+    def store(self, schema):
+        """
+        Stores a serialized form schema, unless an identical schema is
+        already stored
+
+        Returns the schema's ref, for load
+        """
+        schema_json = json.dumps(schema, sort_keys=True, separators=(",", ":"))
+        digest = _schema_digest(schema_json)
+        self.get_or_create(digest=digest, defaults={"schema": schema_json})
+        return self.ref_prefix + digest
+
+    def load(self, ref):
+        """
+        the serialized form schema for a ref from store
+
+        Raises ValueError for a snapshot that doesn't hash to its digest.
+        The schema isn't encrypted with the records that point at it, so
+        this is what keeps an edit to the table from swapping their questions
+        """
+        if not ref.startswith(self.ref_prefix):
+            raise ValueError("Unknown form schema ref {}".format(ref))
+        digest = ref[len(self.ref_prefix) :]
+        return json.loads(_snapshot_schema_json(self.model, digest))
+
+
+def _schema_digest(schema_json):
+    return hashlib.sha256(schema_json.encode("utf-8")).hexdigest()
+
+
+@functools.lru_cache(maxsize=64)
+def _snapshot_schema_json(model, digest):
+    # snapshots are content addressed, so they never change once stored
+    schema_json = model.objects.values_list("schema", flat=True).get(digest=digest)
+    if _schema_digest(schema_json) != digest:
+        raise ValueError("Form schema snapshot {} has been altered".format(digest))
+    return schema_json
@@ -0,0 +1,16 @@
+# Generated by Django 2.2.24 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("delivery", "0040_auto_20171215_0302")]
+
+    operations = [
+        migrations.AddField(
+            model_name="matchreport",
+            name="bucket",
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        )
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.24 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("delivery", "0042_matchingjob")]
+
+    operations = [
+        migrations.CreateModel(
+            name="MatchingWatermark",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("identifier_digest", models.CharField(max_length=64, unique=True)),
+                ("last_swept_id", models.PositiveIntegerField(default=0)),
+                ("encrypted_candidates", models.BinaryField(blank=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        )
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.24 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("delivery", "0043_matchingwatermark")]
+
+    operations = [
+        migrations.CreateModel(
+            name="FormSchemaSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("digest", models.CharField(max_length=64, unique=True)),
+                ("schema", models.TextField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        )
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.24 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("delivery", "0044_formschemasnapshot")]
+
+    operations = [
+        migrations.AddField(
+            model_name="report",
+            name="answer_delta_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="ReportAnswerDelta",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("added", models.DateTimeField(auto_now_add=True)),
+                ("encrypted", models.BinaryField()),
+                (
+                    "report",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="answer_deltas",
+                        to="delivery.Report",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -1,15 +1,23 @@
 import json
 import logging
+import threading
 import uuid
 
 from nacl.exceptions import CryptoError
 
 from django.conf import settings
-from django.db import models
+from django.core.signals import request_finished, request_started
+from django.db import models, transaction
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 
-from . import hashers, model_helpers, security, utils
+from . import envelope, hashers, model_helpers, security, utils
+from .managers import (
+    FormSchemaSnapshotQuerySet,
+    MatchingJobQuerySet,
+    MatchingWatermarkQuerySet,
+    MatchReportQuerySet,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +45,8 @@ class Report(models.Model):
     # <algorithm>$<iterations>$<salt>$
     encode_prefix = models.TextField(null=True)
     salt = models.TextField(null=True)  # used for backwards compatibility
+    # see add_answers
+    answer_delta_count = models.PositiveIntegerField(default=0)
 
     # foreign keys
     owner = models.ForeignKey(
@@ -54,29 +64,87 @@ class Report(models.Model):
         else:
             return None
 
-    def encrypt_record(self, record_data: dict, passphrase: str) -> None:
-        """Encrypts and saves record data, in two formats"""
-        self._store_for_user_decryption(record_data, passphrase)
+    def encrypt_record(
+        self, record_data: dict, passphrase: str, rotate_key: bool = False
+    ) -> None:
+        """
+        Encrypts and saves record data, in two formats
+
+        The key already stretched for the current encode prefix is reused
+        under a fresh nonce. A new salt is only generated with rotate_key,
+        or when the current encode prefix is legacy or outdated.
+        """
+        self._store_for_user_decryption(record_data, passphrase, rotate_key)
         self._store_for_callisto_decryption(record_data)
-        self.save()
+        # record_data is the whole record, so any answer deltas are now stale
+        self.answer_delta_count = 0
+        if self._state.adding:
+            self.save()
+            return
+        with transaction.atomic():
+            self.save()
+            self.answer_deltas.all().delete()
+
+    def add_answers(self, answers: dict, passphrase: str) -> None:
+        """
+        Encrypts and saves changed answers as a ReportAnswerDelta, without
+        rewriting the rest of the record. decrypt_record folds the deltas
+        back in, and the record is compacted into a single encrypted blob
+        again after RECORD_COMPACTION_DELTAS deltas.
+
+        The whole record is rewritten instead when its key is legacy or
+        outdated, or when _store_for_callisto_decryption is overridden,
+        since that hook is given whole records.
+        """
+        if (
+            self.salt
+            or not self.encode_prefix
+            or hashers.must_update(self.encode_prefix)
+            or self._stores_for_callisto_decryption()
+        ):
+            record_data = self._decrypt_answerable_record(passphrase)
+            record_data[utils.RecordDataUtil.answer_key].update(answers)
+            self.encrypt_record(record_data, passphrase)
+            return
+        if not self.answer_delta_count:
+            # deltas can't be folded into plain text records, so check the
+            # record before it gets any, which also rewrites old list records
+            self._decrypt_answerable_record(passphrase)
+        _, key = hashers.make_key(self.encode_prefix, passphrase, None)
+        encrypted = security.encrypt_bytes(key, envelope.dump_record(answers))
+        with transaction.atomic():
+            self.answer_deltas.create(encrypted=encrypted)
+            # counted in the database, so concurrent requests can't lose one
+            self.answer_delta_count = models.F("answer_delta_count") + 1
+            self.save(update_fields=["answer_delta_count", "last_edited"])
+            self.refresh_from_db(fields=["answer_delta_count"])
+            compaction_deltas = getattr(settings, "RECORD_COMPACTION_DELTAS", 20)
+            if self.answer_delta_count >= compaction_deltas:
+                self.encrypt_record(self.decrypt_record(passphrase), passphrase)
 
     def decrypt_record(
         self, passphrase: str  # aka secret key aka passphrase
     ) -> dict or str:
         """decrypts record text from record.encrypted, with the passphrase"""
+        if decrypt_count() is not None:
+            _request_decrypts.count += 1
         if not (self.encode_prefix or self.salt):
             key = self.encryption_setup(passphrase)
         else:
             _, key = hashers.make_key(self.encode_prefix, passphrase, self.salt)
 
-        record_data_string = security.decrypt_text(key, self.encrypted)
-
-        try:
-            decrypted_data = json.loads(record_data_string)
-            return self._return_or_transform(decrypted_data, passphrase)
-        except json.decoder.JSONDecodeError:
+        header, record_data = envelope.load_record(
+            security.decrypt_bytes(key, self.encrypted)
+        )
+        if header and header.version >= 2:
+            # written in the current format, see _store_for_user_decryption
+            record_data = self._with_form_schema(record_data, header.schema_ref)
+        elif isinstance(record_data, str):
             logger.info("decrypting legacy report")
-            return record_data_string
+            return record_data
+        else:
+            record_data = self._return_or_transform(record_data, passphrase)
+        return self._with_answer_deltas(record_data, key)
 
     def withdraw_from_matching(self):
         """Deletes all associated MatchReports"""
@@ -86,11 +154,7 @@ class Report(models.Model):
 
     def encryption_setup(self, passphrase):
         """Generates and stores a random salt"""
-        if self.salt:
-            self.salt = None
-        hasher = hashers.get_hasher()
-        encoded = hasher.encode(passphrase, get_random_string())
-        self.encode_prefix, key = hasher.split_encoded(encoded)
+        key = self._new_encryption_key(passphrase)
         self.save()
         return key
 
@@ -115,12 +179,73 @@ class Report(models.Model):
         else:
             return data
 
-    def _store_for_user_decryption(self, record_data: dict, passphrase: str):
+    def _store_for_user_decryption(
+        self, record_data: dict, passphrase: str, rotate_key: bool = False
+    ):
         """
         store user decryptable data and 500 the request on fails
         """
-        key = self.encryption_setup(passphrase)
-        self.encrypted = security.encrypt_text(key, json.dumps(record_data))
+        if rotate_key or self.salt or hashers.must_update(self.encode_prefix):
+            key = self._new_encryption_key(passphrase)
+        else:
+            _, key = hashers.make_key(self.encode_prefix, passphrase, None)
+        record_data = utils.RecordDataUtil.transform_if_old_format(record_data)
+        record_data, schema_ref = self._without_form_schema(record_data)
+        self.encrypted = security.encrypt_bytes(
+            key, envelope.dump_record(record_data, schema_ref)
+        )
+
+    def _without_form_schema(self, record_data):
+        """
+        moves the form schema out of the record and into a FormSchemaSnapshot,
+        since most records on a site share one of a few identical schemas
+        """
+        form_key = utils.RecordDataUtil.form_key
+        if not (isinstance(record_data, dict) and record_data.get(form_key)):
+            return record_data, ""
+        record_data = dict(record_data)
+        schema = record_data.pop(form_key)
+        return record_data, FormSchemaSnapshot.objects.store(schema)
+
+    def _with_form_schema(self, record_data, schema_ref):
+        if schema_ref:
+            form_key = utils.RecordDataUtil.form_key
+            record_data[form_key] = FormSchemaSnapshot.objects.load(schema_ref)
+        return record_data
+
+    def _with_answer_deltas(self, record_data, key):
+        if self.answer_delta_count:
+            answers = record_data[utils.RecordDataUtil.answer_key]
+            for delta in self.answer_deltas.order_by("pk"):
+                _, changed = envelope.load_record(
+                    security.decrypt_bytes(key, delta.encrypted)
+                )
+                answers.update(changed)
+        return record_data
+
+    def _new_encryption_key(self, passphrase):
+        """generates a random salt, and stretches a key for it without saving"""
+        if self.salt:
+            self.salt = None
+        hasher = hashers.get_hasher()
+        encoded = hasher.encode(passphrase, get_random_string())
+        self.encode_prefix, key = hasher.split_encoded(encoded)
+        hashers.remember_key(self.encode_prefix, passphrase, key)
+        return key
+
+    def _decrypt_answerable_record(self, passphrase):
+        record_data = self.decrypt_record(passphrase)
+        if isinstance(record_data, str):
+            raise ValueError(
+                "Report(pk={}) is plain text, and has no answers".format(self.pk)
+            )
+        return record_data
+
+    def _stores_for_callisto_decryption(self):
+        return (
+            type(self)._store_for_callisto_decryption
+            is not Report._store_for_callisto_decryption
+        )
 
     def _store_for_callisto_decryption(self, record_data: dict):
         pass
@@ -129,6 +254,22 @@ class Report(models.Model):
         ordering = ("-added",)
 
 
+class ReportAnswerDelta(models.Model):
+    """
+    Answers changed on a single wizard step, encrypted with the same key
+    as the report they belong to. See Report.add_answers
+    """
+
+    report = models.ForeignKey(
+        Report, on_delete=models.CASCADE, related_name="answer_deltas"
+    )
+    added = models.DateTimeField(auto_now_add=True)
+    encrypted = models.BinaryField()
+
+    def __str__(self):
+        return "ReportAnswerDelta for report(pk={0})".format(self.report_id)
+
+
 class MatchReport(models.Model):
     """
     A report that indicates the user wants to submit if a match is found.
@@ -143,12 +284,23 @@ class MatchReport(models.Model):
     encode_prefix = models.TextField(blank=True)
     salt = models.TextField(null=True)  # used for backwards compatibility
 
+    # see security.match_bucket
+    bucket = models.CharField(blank=True, null=True, max_length=64, db_index=True)
+
+    objects = MatchReportQuerySet.as_manager()
+
     def __str__(self):
         return "MatchReport for report(pk={0})".format(self.report.pk)
 
     @property
     def match_found(self):
-        self.report.refresh_from_db()
+        """
+        Whether the report has been matched, read fresh from the database.
+        Rows from MatchReport.objects.with_match_found() carry it already
+        """
+        if hasattr(self, "report_match_found"):
+            return self.report_match_found
+        self.report.refresh_from_db(fields=["match_found"])
         return self.report.match_found
 
     def encrypt_match_report(
@@ -174,6 +326,7 @@ class MatchReport(models.Model):
         self.encrypted = security.pepper(
             security.encrypt_text(stretched_identifier, report_text)
         )
+        self.bucket = security.match_bucket(identifier)
         self.save()
 
     def get_match(
@@ -182,20 +335,178 @@ class MatchReport(models.Model):
         """
         Checks if the given identifier triggers a match on this report.
         Returns report text if so.
-        """
-        decrypted_report = None
 
-        prefix, stretched_identifier = hashers.make_key(
-            self.encode_prefix, identifier, self.salt
-        )
+        Text already decrypted with this identifier, by matching or an
+        earlier call, is returned without stretching the identifier again.
+        """
+        remembered = getattr(self, "_decrypted_matches", {})
+        if identifier in remembered:
+            return remembered[identifier]
         try:
-            decrypted_report = security.decrypt_text(
-                stretched_identifier, security.unpepper(self.encrypted)
-            )
+            encrypted_report = security.unpepper(self.encrypted)
         except CryptoError:
-            pass
+            return None
+        decrypted_report = security.decrypt_with_identifier(
+            self.encode_prefix, self.salt, encrypted_report, identifier
+        )
+        if decrypted_report is not None:
+            self.backfill_bucket(identifier)
+            self.remember_match(identifier, decrypted_report)
         return decrypted_report
 
+    def remember_match(self, identifier: str, decrypted_report: str) -> None:
+        """keeps text decrypted with identifier on this instance, for get_match"""
+        if not hasattr(self, "_decrypted_matches"):
+            self._decrypted_matches = {}
+        self._decrypted_matches[identifier] = decrypted_report
+
+    def may_be_in_bucket(self, bucket):
+        """
+        whether this MatchReport might have been encrypted with an identifier
+        from this bucket, see MatchReportQuerySet.in_bucket
+        """
+        return not bucket or not self.bucket or self.bucket == bucket
+
+    def backfill_bucket(self, identifier):
+        """fill in the bucket of rows created before bucketing, or cleared by rebucket"""
+        bucket = security.match_bucket(identifier)
+        if bucket and bucket != self.bucket:
+            self.bucket = bucket
+            MatchReport.objects.filter(pk=self.pk).update(bucket=bucket)
+
+
+class MatchingWatermark(models.Model):
+    """
+    How far matching has swept the MatchReports for one identifier,
+    so the next sweep only has to try MatchReports added since.
+    Only kept when settings.MATCHING_WATERMARKS is on.
+    """
+
+    # see security.identifier_digest
+    identifier_digest = models.CharField(max_length=64, unique=True)
+    last_swept_id = models.PositiveIntegerField(default=0)
+    # json list of the MatchReport ids up to last_swept_id that the
+    # identifier decrypts, encrypted with a key derived from the identifier
+    encrypted_candidates = models.BinaryField(blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = MatchingWatermarkQuerySet.as_manager()
+
+    def __str__(self):
+        return "MatchingWatermark(last_swept_id={})".format(self.last_swept_id)
+
+    @staticmethod
+    def digest(identifier: str) -> str:
+        return security.identifier_digest(identifier, "watermark").hex()
+
+    def get_candidate_ids(self, identifier: str) -> list:
+        if not self.encrypted_candidates:
+            return []
+        return json.loads(
+            security.decrypt_text(
+                self._candidates_key(identifier), self.encrypted_candidates
+            )
+        )
+
+    def set_candidate_ids(self, identifier: str, candidate_ids: list) -> None:
+        self.encrypted_candidates = security.encrypt_text(
+            self._candidates_key(identifier), json.dumps(candidate_ids)
+        )
+
+    def _candidates_key(self, identifier):
+        return security.identifier_digest(identifier, "watermark candidates")
+
+
+class MatchingJob(models.Model):
+    """
+    A matching run for the identifiers entered on a report, queued by the
+    matching views and run by callisto_core.reporting.tasks.RunMatchingJob
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    report = models.ForeignKey(Report, on_delete=models.CASCADE)
+    site_id = models.PositiveIntegerField(default=1)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+
+    # peppered json list of identifiers, cleared once the job has run, or
+    # by the expire_matching_jobs command if it never does
+    encrypted_identifiers = models.BinaryField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    rows_scanned = models.PositiveIntegerField(default=0)
+    matches_found = models.PositiveIntegerField(default=0)
+
+    objects = MatchingJobQuerySet.as_manager()
+
+    def __str__(self):
+        return "MatchingJob(pk={}, status={})".format(self.pk, self.status)
+
+    @property
+    def duration(self):
+        if self.started and self.finished:
+            return self.finished - self.started
+        else:
+            return None
+
+    def set_identifiers(self, identifiers: list) -> None:
+        self.encrypted_identifiers = security.pepper(
+            json.dumps(identifiers).encode("utf-8")
+        )
+
+    def get_identifiers(self) -> list:
+        if not self.encrypted_identifiers:
+            return []
+        return json.loads(security.unpepper(self.encrypted_identifiers))
+
+    def start(self):
+        self.status = self.RUNNING
+        self.started = timezone.now()
+        self.save()
+
+    def finish(self):
+        self._end(self.DONE)
+
+    def fail(self):
+        self._end(self.FAILED)
+
+    def _end(self, status):
+        self.status = status
+        self.finished = timezone.now()
+        self.encrypted_identifiers = b""
+        self.save()
+
+
+class FormSchemaSnapshot(models.Model):
+    """
+    A serialized form schema that reports were answered against. Reports
+    only store the schema's ref (see FormSchemaSnapshotQuerySet.store)
+    inside their encrypted record. Snapshots are content addressed, and
+    never changed or deleted, since encrypted records can't be checked
+    for the refs they hold.
+    """
+
+    # sha256 of the schema's canonical json
+    digest = models.CharField(max_length=64, unique=True)
+    schema = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = FormSchemaSnapshotQuerySet.as_manager()
+
+    def __str__(self):
+        return "FormSchemaSnapshot(digest={})".format(self.digest)
+
 
 class SentFullReport(models.Model):
     """Report of a single incident since to the monitoring organization"""
@@ -217,3 +528,31 @@ class SentMatchReport(models.Model):
 
     def get_report_id(self):
         return f"{self.id}-1"
+
+
+def decrypt_count():
+    """
+    How many times the current request has decrypted a record. Only
+    counted with DEBUG on, and None otherwise
+    """
+    return getattr(_request_decrypts, "count", None)
+
+
+def start_decrypt_count(**kwargs):
+    _request_decrypts.count = 0 if settings.DEBUG else None
+
+
+def log_decrypt_count(**kwargs):
+    count = decrypt_count()
+    if count:
+        logger.debug("request decrypted records {} times".format(count))
+    _request_decrypts.count = None
+
+
+_request_decrypts = threading.local()
+request_started.connect(
+    start_decrypt_count, dispatch_uid="callisto_core_start_decrypt_count"
+)
+request_finished.connect(
+    log_decrypt_count, dispatch_uid="callisto_core_log_decrypt_count"
+)
@@ -1,27 +1,46 @@
+import codecs
+import hashlib
+import hmac
+import itertools
+
+import nacl.bindings
 import nacl.secret
 import nacl.utils
+from nacl.exceptions import CryptoError
 
 from django.conf import settings
+from django.utils.encoding import force_bytes
+
+from . import hashers
+
+
+# records are encrypted as a libsodium secretstream, a chunk at a time:
+#   STREAM_PREFIX, the secretstream header,
+#   then for each chunk: its ciphertext length (4 bytes, big endian), its ciphertext
+# the last chunk is tagged as final, so a truncated record fails to decrypt
+STREAM_PREFIX = b"\xcaSS\x01"  # magic bytes, then the format version
+STREAM_CHUNK_SIZE = 64 * 1024
+_TAG_MESSAGE = nacl.bindings.crypto_secretstream_xchacha20poly1305_TAG_MESSAGE
+_TAG_FINAL = nacl.bindings.crypto_secretstream_xchacha20poly1305_TAG_FINAL
 
 
 def encrypt_text(key, sensitive_text):
     """
     Encrypts a report using the given secret key.
     Requires a stretched key with a length of 32 bytes.
-    The encryption uses PyNacl & Salsa20 stream cipher.
+    The encryption uses PyNacl's secretstream (XChaCha20-Poly1305),
+    a chunk at a time, see encrypt_chunks.
 
     Returns:
       bytes: the encrypted bytes of the sensitive_text
 
     """
-    box = nacl.secret.SecretBox(key)
-    message = sensitive_text.encode("utf-8")
-    nonce = nacl.utils.random(nacl.secret.SecretBox.NONCE_SIZE)
-    return box.encrypt(message, nonce)
+    return encrypt_bytes(key, _text_chunks(sensitive_text))
 
 
 def decrypt_text(key, encrypted_text):
-    """Decrypts an encrypted report.
+    """Decrypts an encrypted report, in either the chunked or the
+    single SecretBox format.
 
     Returns:
       str: the decrypted encrypted_text as a string
@@ -30,10 +49,158 @@ def decrypt_text(key, encrypted_text):
       CryptoError: In case of a failure to decrypt the encrypted_text
 
     """
+    return _decode_chunks(decrypt_bytes(key, encrypted_text))
+
+
+def encrypt_bytes(key, chunks):
+    """
+    Like encrypt_text, for an iterable of byte chunks
+
+    Returns:
+      bytes: the encrypted bytes of the joined chunks
+
+    """
+    chunks = (chunk for chunk in chunks if chunk)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        # secretstream can't authenticate an empty final chunk
+        return _encrypt_secretbox(key, b"")
+    return b"".join(encrypt_chunks(key, itertools.chain([first_chunk], chunks)))
+
+
+def decrypt_bytes(key, encrypted_text):
+    """
+    Like decrypt_text, without decoding the decrypted bytes
+
+    Yields:
+      bytes: the decrypted byte chunks, one at a time
+
+    Raises:
+      CryptoError: In case of a failure to decrypt the encrypted_text
+
+    """
+    if is_chunked(encrypted_text):
+        chunks = decrypt_chunks(key, _slices(memoryview(encrypted_text)))
+        try:
+            first_chunk = next(chunks)
+        except CryptoError:
+            # a SecretBox nonce that happens to start with STREAM_PREFIX
+            pass
+        else:
+            yield first_chunk
+            yield from chunks
+            return
     box = nacl.secret.SecretBox(key)
     # need to force to bytes bc BinaryField can return as memoryview
-    decrypted = box.decrypt(bytes(encrypted_text)).decode("utf-8")
-    return decrypted
+    yield box.decrypt(bytes(encrypted_text))
+
+
+def is_chunked(encrypted_text):
+    return bytes(encrypted_text[: len(STREAM_PREFIX)]) == STREAM_PREFIX
+
+
+def encrypt_chunks(key, chunks):
+    """
+    Encrypts an iterable of byte chunks, without holding more than a
+    couple of chunks in memory at once.
+
+    Yields:
+      bytes: the format header, then one length prefixed ciphertext per chunk
+
+    Raises:
+      ValueError: if there are no non-empty chunks to encrypt
+
+    """
+    state = nacl.bindings.crypto_secretstream_xchacha20poly1305_state()
+    header = nacl.bindings.crypto_secretstream_xchacha20poly1305_init_push(state, key)
+    chunks = (bytes(chunk) for chunk in chunks if chunk)
+    chunk = next(chunks, None)
+    if chunk is None:
+        raise ValueError("no data to encrypt")
+    yield STREAM_PREFIX + header
+    while chunk is not None:
+        next_chunk = next(chunks, None)
+        tag = _TAG_FINAL if next_chunk is None else _TAG_MESSAGE
+        ciphertext = nacl.bindings.crypto_secretstream_xchacha20poly1305_push(
+            state, chunk, tag=tag
+        )
+        yield len(ciphertext).to_bytes(4, "big") + ciphertext
+        chunk = next_chunk
+
+
+def decrypt_chunks(key, encrypted_chunks):
+    """
+    Decrypts an iterable of encrypted byte chunks from encrypt_chunks. The
+    encrypted chunks may be split anywhere.
+
+    Yields:
+      bytes: the decrypted chunks
+
+    Raises:
+      CryptoError: In case of a failure to decrypt, or a truncated stream
+
+    """
+    reader = _ChunkReader(encrypted_chunks)
+    if reader.read(len(STREAM_PREFIX)) != STREAM_PREFIX:
+        raise CryptoError("Unknown record format")
+    state = nacl.bindings.crypto_secretstream_xchacha20poly1305_state()
+    nacl.bindings.crypto_secretstream_xchacha20poly1305_init_pull(
+        state,
+        reader.read(nacl.bindings.crypto_secretstream_xchacha20poly1305_HEADERBYTES),
+        key,
+    )
+    tag = None
+    while tag != _TAG_FINAL:
+        length = reader.read(4)
+        if len(length) < 4:
+            raise CryptoError("Record ended before its final chunk")
+        chunk, tag = nacl.bindings.crypto_secretstream_xchacha20poly1305_pull(
+            state, reader.read(int.from_bytes(length, "big"))
+        )
+        yield chunk
+    if reader.read(1):
+        raise CryptoError("Record continues past its final chunk")
+
+
+class _ChunkReader(object):
+    """reads exact lengths from an iterable of arbitrarily split chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def read(self, size):
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _text_chunks(text):
+    for start in range(0, len(text), STREAM_CHUNK_SIZE):
+        yield text[start : start + STREAM_CHUNK_SIZE].encode("utf-8")
+
+
+def _slices(view):
+    for start in range(0, len(view), STREAM_CHUNK_SIZE):
+        yield view[start : start + STREAM_CHUNK_SIZE]
+
+
+def _decode_chunks(chunks):
+    """decodes utf-8 byte chunks, which may split characters"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    text = "".join(decoder.decode(chunk) for chunk in chunks)
+    return text + decoder.decode(b"", final=True)
+
+
+def _encrypt_secretbox(key, message):
+    box = nacl.secret.SecretBox(key)
+    nonce = nacl.utils.random(nacl.secret.SecretBox.NONCE_SIZE)
+    return box.encrypt(message, nonce)
 
 
 def pepper(encrypted_report):
@@ -80,3 +247,95 @@ def unpepper(peppered_report):
     # need to force to bytes bc BinaryField can return as memoryview
     decrypted = box.decrypt(bytes(peppered_report))
     return decrypted
+
+
+def decrypt_with_identifier(encode_prefix, salt, encrypted_report, identifier):
+    """
+    Stretches an identifier against a MatchReport's encode prefix and
+    decrypts the MatchReport with it. Touches neither the database nor
+    the pepper, so it can be run outside of the process that loaded
+    the MatchReport.
+
+    Args:
+      encode_prefix (str): the MatchReport's encode prefix
+      salt (str): the MatchReport's legacy salt
+      encrypted_report (bytes): the MatchReport's unpeppered report text
+      identifier (str): the matching identifier to try
+
+    Returns:
+      str: the report text, or None if the identifier doesn't decrypt it
+
+    """
+    return decrypt_with_identifiers(
+        encode_prefix, salt, encrypted_report, [identifier]
+    )[0]
+
+
+def decrypt_with_identifiers(encode_prefix, salt, encrypted_report, identifiers):
+    """
+    Like decrypt_with_identifier, for several identifiers at once. The encode
+    prefix is only parsed once.
+
+    Returns:
+      list: the report text or None, for each identifier in order
+
+    """
+    parameters = hashers.key_parameters(encode_prefix, salt)
+    results = []
+    for identifier in identifiers:
+        _, stretched_identifier = hashers.stretch_key(parameters, identifier)
+        try:
+            results.append(decrypt_text(stretched_identifier, encrypted_report))
+        except CryptoError:
+            results.append(None)
+    return results
+
+
+def match_bucket(identifier):
+    """
+    Computes a truncated, server keyed index of a matching identifier.
+    Every MatchReport encrypted with the same identifier lands in the same
+    bucket, so matching only has to stretch keys for the rows in one bucket.
+
+    Set settings.MATCH_BUCKET_LENGTH to the number of hex characters to keep.
+    Shorter buckets are shared by more identifiers, which gives away less
+    about which reports share an identifier, at the cost of slower matching.
+    Run the rebucket_match_reports command after changing it.
+
+    Args:
+      identifier (str): the matching identifier
+
+    Returns:
+      str: the bucket, or None if bucketing is disabled
+
+    """
+    length = getattr(settings, "MATCH_BUCKET_LENGTH", 0)
+    if not length:
+        return None
+    digest = hmac.new(
+        force_bytes(settings.INDEXING_KEY), force_bytes(identifier), hashlib.sha256
+    ).hexdigest()
+    return digest[:length]
+
+
+def identifier_digest(identifier, purpose):
+    """
+    Computes a full length, server keyed digest of a matching identifier.
+    Unlike match_bucket, this identifies a single identifier, so anyone
+    holding both the database and settings.INDEXING_KEY can confirm a
+    guessed identifier without stretching a key. Only use it for opt in
+    features.
+
+    Args:
+      identifier (str): the matching identifier
+      purpose (str): separates the digests used for different things
+
+    Returns:
+      bytes: a 32 byte digest
+
+    """
+    return hmac.new(
+        force_bytes(settings.INDEXING_KEY),
+        force_bytes(f"{purpose}:{identifier}"),
+        hashlib.sha256,
+    ).digest()
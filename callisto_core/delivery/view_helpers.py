@@ -8,6 +8,7 @@ docs / reference:
 
 """
 import logging
+from copy import deepcopy
 
 from django.urls import reverse
 
@@ -82,6 +83,7 @@ class _LegacyReportStorageHelper(ReportStorageHelper):
             self.storage_form_key: self.serialized_forms,
         }
         self.report.encrypt_record(storage, self.passphrase)
+        self.invalidate()
 
 
 class EncryptedReportStorageHelper(
@@ -91,21 +93,43 @@ class EncryptedReportStorageHelper(
     # WARNING: do not change! record data is keyed on this value
     storage_data_key = "data"
 
+    # the decrypted record, see current_data_from_storage
+    _current_data = None
+
     @classmethod
     def empty_storage(cls) -> dict:
         return {cls.storage_data_key: {}, cls.storage_form_key: {}}
 
     def current_data_from_storage(self) -> dict:
         if self.passphrase:
-            return self.report.decrypt_record(self.passphrase)
+            # decrypted once per request, and copied since callers change it
+            if self._current_data is None:
+                self._current_data = self.report.decrypt_record(self.passphrase)
+            return deepcopy(self._current_data)
         else:
             return self.empty_storage()
 
     def add_data_to_storage(self, data):
         if self.passphrase:
             storage = self.current_data_from_storage()
-            storage[self.storage_data_key] = data
-            self.report.encrypt_record(storage, self.passphrase)
+            answers = storage[self.storage_data_key]
+            if set(answers) - set(data):
+                # answers were removed, which deltas can't express
+                storage[self.storage_data_key] = data
+                self.report.encrypt_record(storage, self.passphrase)
+                self.invalidate()
+                return
+            changed = {
+                key: value
+                for key, value in data.items()
+                if key not in answers or answers[key] != value
+            }
+            if changed:
+                self.report.add_answers(changed, self.passphrase)
+                self.invalidate()
+
+    def invalidate(self):
+        self._current_data = None
 
     def init_storage(self):
         if self.passphrase:
@@ -42,7 +42,7 @@ from callisto_core.wizard_builder import (
     view_partials as wizard_builder_partials,
 )
 
-from . import forms, models, view_helpers
+from . import forms, hashers, models, view_helpers
 
 logger = logging.getLogger(__name__)
 
@@ -125,6 +125,7 @@ class _ReportAccessPartial(_ReportLimitedDetailPartial):
     invalid_access_key_message = "Invalid key in access request"
     invalid_access_user_message = "Invalid user in access request"
     invalid_access_no_key_message = "No key in access request"
+    key_derivation_busy_message = "Too many key derivations, try again shortly"
     form_class = forms.ReportAccessForm
     access_form_class = forms.ReportAccessForm
 
@@ -165,6 +166,12 @@ class _ReportAccessPartial(_ReportLimitedDetailPartial):
         return next_url
 
     def dispatch(self, request, *args, **kwargs):
+        try:
+            return self._dispatch_with_access(request, *args, **kwargs)
+        except hashers.KeyDerivationBusy as error:
+            return self._render_key_derivation_busy(error)
+
+    def _dispatch_with_access(self, request, *args, **kwargs):
         logger.debug(f"{self.__class__.__name__} access check")
 
         if (
@@ -187,6 +194,12 @@ class _ReportAccessPartial(_ReportLimitedDetailPartial):
         context = self.get_context_data(form=self._get_access_form())
         return self.render_to_response(context)
 
+    def _render_key_derivation_busy(self, error):
+        logger.warning(self.key_derivation_busy_message)
+        response = HttpResponse(self.key_derivation_busy_message, status=503)
+        response["Retry-After"] = str(error.retry_after)
+        return response
+
     def _redirect_from_passphrase(self, request):
         return redirect(self._passphrase_next_url(request))
 
@@ -217,7 +230,10 @@ class EncryptedWizardPartial(
     EVAL_ACTION_TYPE = "EDIT"
 
     def dispatch(self, request, *args, **kwargs):
-        self._dispatch_processing()
+        try:
+            self._dispatch_processing()
+        except hashers.KeyDerivationBusy as error:
+            return self._render_key_derivation_busy(error)
         return super().dispatch(request, *args, **kwargs)
 
     def _rendering_done_hook(self):
@@ -228,6 +228,44 @@ class CallistoCoreNotificationApi(object):
         )
         self.send()
 
+    def send_match_notifications(
+        self,
+        matches: list,
+        identifier: str,
+        site_id: int,
+        admin_email_template_name: str = "",
+    ):
+        """
+        Sends every notification for the matches found for one identifier:
+        the report to the coordinator, an email to each matched owner, and
+        the alerts to the callisto team
+
+        Called by reporting.tasks.RunMatchingJob after a matching run
+        """
+        self.send_matching_report_to_authority(
+            matches=matches,
+            identifier=identifier,
+            to_addresses=TenantApi.site_settings("COORDINATOR_EMAIL", site_id=site_id),
+            public_key=TenantApi.site_settings(
+                "COORDINATOR_PUBLIC_KEY", site_id=site_id
+            ),
+        )
+        for match in matches:
+            self.send_match_notification(match_report=match)
+        if not TenantApi.site_settings("DEMO_MODE", cast=bool, site_id=site_id):
+            self.slack_notification(
+                msg="New Callisto Matches (details will be sent via email)",
+                type="match_confirmation",
+            )
+            self.send_with_kwargs(
+                site_id=site_id,  # required in general
+                email_template_name=admin_email_template_name,  # the email template
+                to_addresses=self.ALERT_LIST,  # addresses to send to
+                matches=matches,  # used in the email body
+                email_subject="New Callisto Matches",  # rendered as the email subject
+                email_name="match_confirmation_callisto_team",  # used in test assertions
+            )
+
     def send_match_notification(self, match_report):
         """
         Notifies reporting user that a match has been found.
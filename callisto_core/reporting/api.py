@@ -1,19 +1,64 @@
+import base64
+import json
 import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from callisto_core.delivery import hashers, security
+from callisto_core.utils.api import NotificationApi
+
+from . import matching
 
 logger = logging.getLogger(__name__)
 
 
+def seal(data):
+    """peppers json data into a string that can pass through the broker"""
+    return base64.b64encode(security.pepper(json.dumps(data).encode("utf-8"))).decode(
+        "ascii"
+    )
+
+
+def unseal(sealed):
+    return json.loads(security.unpepper(base64.b64decode(sealed)))
+
+
+def seal_identifiers(identifiers):
+    return seal(identifiers)
+
+
+def unseal_identifiers(sealed_identifiers):
+    return unseal(sealed_identifiers)
+
+
 class CallistoCoreMatchingApi(object):
+    # reports per UPDATE when marking matches found
+    update_batch_size = 500
+
     @property
-    def match_reports(_):
+    def match_reports(self):
         from callisto_core.delivery.models import MatchReport
 
-        return MatchReport.objects.all()
+        return (
+            MatchReport.objects.in_buckets(self.identifiers)
+            .select_related("report__owner")
+            .defer("report__encrypted", "report__encrypted_eval")
+            .order_by("pk")
+        )
+
+    @property
+    def matching_engine(self):
+        return matching.get_engine()
 
     @property
     def transforms(self):
         return [
             self._resolve_reports_decryptable_with_identifier,
+            self._rehash_legacy_match_reports,
             self._resolve_reports_with_duplicate_owners,
             self._resolve_match_is_between_two_or_more_reports,
             self._resolve_already_matched_reports,
@@ -21,11 +66,81 @@ class CallistoCoreMatchingApi(object):
         ]
 
     def find_matches(self, identifier):
-        self.identifier = identifier
-        match_list = self.match_reports
+        return self.find_matches_many([identifier])[identifier]
+
+    def find_matches_many(self, identifiers):
+        """
+        Finds matches for several identifiers with one pass over the
+        MatchReport table. Every candidate is tried against every identifier
+        it might match, before the remaining transforms run per identifier.
+
+        Returns a dict of identifier => match list
+        """
+        self.identifiers = list(dict.fromkeys(identifiers))
+        self.sweep_started = timezone.now()
+        self._load_watermarks()
+        engine = self.matching_engine
+        self.decrypted_match_reports = engine.decryptable_many(
+            self._sweep(
+                self._unswept(self.match_reports).iterator(
+                    chunk_size=getattr(settings, "MATCHING_CHUNK_SIZE", 2000)
+                )
+            ),
+            self.identifiers,
+            self._last_swept_ids(),
+        )
+        self.rows_scanned = engine.rows_scanned
+        logger.debug(f"all reports => match_reports:{self.rows_scanned}")
+        self._add_known_candidates()
+        self._save_watermarks()
+
+        self._share_reports(self.decrypted_match_reports.values())
+        return {
+            identifier: self._transform(
+                identifier, self.decrypted_match_reports[identifier]
+            )
+            for identifier in self.identifiers
+        }
+
+    def find_matches_for_job(self, job):
+        """
+        Finds matches for the identifiers of a MatchingJob, and records the
+        size of the sweep on it
 
-        logger.debug(f"all reports => match_reports:{len(match_list)}")
-        for func in self.transforms:
+        Returns a dict of identifier => match list
+        """
+        return self._record_sweep(job, self.find_matches_many(job.get_identifiers()))
+
+    def run_matching_job(self, job, admin_email_template_name=""):
+        """
+        Finds and notifies the matches for a MatchingJob, then finishes it.
+        Runs in reporting.tasks.RunMatchingJob
+        """
+        self.finish_matching_job(
+            job, self.find_matches_for_job(job), admin_email_template_name
+        )
+
+    def finish_matching_job(self, job, matches, admin_email_template_name=""):
+        """notifies the matches found for a MatchingJob, then marks it done"""
+        for identifier, match_list in matches.items():
+            if match_list:
+                NotificationApi.send_match_notifications(
+                    matches=match_list,
+                    identifier=identifier,
+                    site_id=job.site_id,
+                    admin_email_template_name=admin_email_template_name,
+                )
+        job.finish()
+        logger.info(f"{job} scanned {job.rows_scanned} match reports in {job.duration}")
+
+    def _record_sweep(self, job, matches):
+        job.rows_scanned = self.rows_scanned
+        job.matches_found = sum(len(match_list) for match_list in matches.values())
+        return matches
+
+    def _transform(self, identifier, match_list, transforms=None):
+        self.identifier = identifier
+        for func in transforms or self.transforms:
             if match_list:
                 match_list = func(match_list)
                 logger.debug(f"post {func.__name__} => {match_list}")
@@ -35,21 +150,135 @@ class CallistoCoreMatchingApi(object):
 
         return match_list
 
+    def _load_watermarks(self):
+        """
+        With settings.MATCHING_WATERMARKS on, each identifier remembers the
+        highest MatchReport id it was tried against, and which MatchReports
+        it decrypted up to there. Only newer MatchReports are tried again.
+        """
+        from callisto_core.delivery.models import MatchingWatermark
+
+        self.watermarks = {}
+        self.candidate_ids = {}
+        if getattr(settings, "MATCHING_WATERMARKS", False):
+            self.watermarks = MatchingWatermark.objects.for_identifiers(
+                self.identifiers
+            )
+            self.candidate_ids = {
+                identifier: watermark.get_candidate_ids(identifier)
+                for identifier, watermark in self.watermarks.items()
+            }
+
+    def _last_swept_ids(self):
+        if self.watermarks:
+            return [
+                self.watermarks[identifier].last_swept_id
+                for identifier in self.identifiers
+            ]
+        else:
+            return None
+
+    def _unswept(self, match_reports):
+        if not self.watermarks:
+            return match_reports
+        known_ids = set().union(*self.candidate_ids.values())
+        return match_reports.filter(
+            Q(pk__gt=min(self._last_swept_ids())) | Q(pk__in=known_ids)
+        )
+
+    def _sweep(self, match_reports):
+        """
+        passes match reports through to the engine, keeping aside the ones
+        already known to decrypt, and the highest id that has settled.
+        rows added within MATCHING_WATERMARK_OVERLAP of the sweep may still
+        have uncommitted neighbours, so they are swept again next time
+        """
+        known_ids = set().union(*self.candidate_ids.values())
+        settled = self.sweep_started - timedelta(
+            seconds=getattr(settings, "MATCHING_WATERMARK_OVERLAP", 300)
+        )
+        self.known_match_reports = {}
+        self.last_settled_id = 0
+        for match_report in match_reports:
+            if match_report.pk in known_ids:
+                self.known_match_reports[match_report.pk] = match_report
+            if match_report.added < settled:
+                self.last_settled_id = match_report.pk
+            yield match_report
+
+    def _add_known_candidates(self):
+        for identifier, candidate_ids in self.candidate_ids.items():
+            self.decrypted_match_reports[identifier] = [
+                self.known_match_reports[pk]
+                for pk in candidate_ids
+                if pk in self.known_match_reports
+            ] + self.decrypted_match_reports[identifier]
+
+    def _save_watermarks(self):
+        from callisto_core.delivery.models import MatchingWatermark
+
+        for identifier, watermark in self.watermarks.items():
+            last_swept_id = max(watermark.last_swept_id, self.last_settled_id)
+            watermark.last_swept_id = last_swept_id
+            watermark.set_candidate_ids(
+                identifier,
+                [
+                    match_report.pk
+                    for match_report in self.decrypted_match_reports[identifier]
+                    if match_report.pk <= last_swept_id
+                ],
+            )
+            MatchingWatermark.objects.update_or_create(
+                identifier_digest=watermark.identifier_digest,
+                defaults={
+                    "last_swept_id": watermark.last_swept_id,
+                    "encrypted_candidates": watermark.encrypted_candidates,
+                },
+            )
+
+    def _share_reports(self, match_lists):
+        """
+        point match reports of the same report at one Report instance, so a
+        match found for one identifier is seen when transforming the next
+        """
+        reports = {}
+        for match_list in match_lists:
+            for match_report in match_list:
+                match_report.report = reports.setdefault(
+                    match_report.report_id, match_report.report
+                )
+
     def _resolve_reports_decryptable_with_identifier(self, match_list):
-        return [
+        return self.decrypted_match_reports[self.identifier]
+
+    def _rehash_legacy_match_reports(self, match_list):
+        """
+        re-encrypts match reports still on legacy key stretching parameters
+        while the identifier that decrypts them is known, so every sweep
+        after this one stretches a cheaper or stronger key for them
+        """
+        legacy = [
             match_report
             for match_report in match_list
-            if match_report.get_match(self.identifier)
+            if hashers.must_update(match_report.encode_prefix)
         ]
+        for match_report in legacy:
+            match_report.encrypt_match_report(
+                match_report.get_match(self.identifier), self.identifier
+            )
+        if legacy:
+            # see the legacy_match_reports command for the remaining count
+            logger.info(f"rehashed match_reports:{len(legacy)}")
+        return match_list
 
     def _resolve_reports_with_duplicate_owners(self, match_list):
         new_match_list = []
-        report_owners = []
+        report_owners = set()
 
         for match in match_list:
-            if match.report.owner not in report_owners:
+            if match.report.owner_id not in report_owners:
                 new_match_list.append(match)
-                report_owners.append(match.report.owner)
+                report_owners.add(match.report.owner_id)
 
         return new_match_list
 
@@ -67,7 +296,191 @@ class CallistoCoreMatchingApi(object):
         ]
 
     def _update_match_found(self, match_list):
-        for match in match_list:
-            match.report.match_found = True
-            match.report.save()
+        from callisto_core.delivery.models import Report
+
+        reports = {match.report.pk: match.report for match in match_list}
+        report_ids = list(reports)
+        now = timezone.now()
+        with transaction.atomic():
+            for start in range(0, len(report_ids), self.update_batch_size):
+                Report.objects.filter(
+                    pk__in=report_ids[start : start + self.update_batch_size]
+                ).update(match_found=True, last_edited=now)
+        for report in reports.values():
+            report.match_found = True
+            report.last_edited = now
         return match_list
+
+
+class DistributedMatchingApi(CallistoCoreMatchingApi):
+    """
+    Splits the MatchReport id range into shards of MATCHING_SHARD_SIZE ids.
+    For a MatchingJob, each shard is tried by its own celery task, and a
+    chord callback runs the rest of the transforms once, centrally, then
+    notifies the matches and finishes the job. Nothing waits on the shards,
+    so job tasks never hold a worker while other tasks run.
+
+    Only MatchReport ids, peppered identifiers, and peppered match text pass
+    through the broker. Outside of eager mode, celery needs a result backend
+    for the chord. Watermarks are not kept in this mode.
+    """
+
+    @property
+    def shard_size(self):
+        return getattr(settings, "MATCHING_SHARD_SIZE", 10000)
+
+    @property
+    def shard_transforms(self):
+        """run by each shard, on the match reports it decrypted"""
+        return [self._rehash_legacy_match_reports]
+
+    @property
+    def transforms(self):
+        """run by the chord callback, on the match reports of every shard"""
+        return [
+            self._resolve_reports_decryptable_with_identifier,
+            self._resolve_reports_with_duplicate_owners,
+            self._resolve_match_is_between_two_or_more_reports,
+            self._resolve_already_matched_reports,
+            self._update_match_found,
+        ]
+
+    def find_matches_many(self, identifiers):
+        """
+        Tries each shard in this process, one after the other. Matching jobs
+        try shards in celery tasks instead, see run_matching_job
+        """
+        self.identifiers = list(dict.fromkeys(identifiers))
+        sealed_identifiers = seal_identifiers(self.identifiers)
+        return self._collect(
+            [
+                self.match_shard(sealed_identifiers, first_id, last_id)
+                for first_id, last_id in self._shards()
+            ]
+        )
+
+    def run_matching_job(self, job, admin_email_template_name=""):
+        """
+        Starts a task for each shard, with collect_shards as the chord
+        callback, and returns without waiting for them
+        """
+        from celery import chord
+
+        from . import tasks
+
+        self.identifiers = list(dict.fromkeys(job.get_identifiers()))
+        sealed_identifiers = seal_identifiers(self.identifiers)
+        shards = [
+            tasks.MatchShard.s(sealed_identifiers, first_id, last_id)
+            for first_id, last_id in self._shards()
+        ]
+        if not shards:
+            self.rows_scanned = 0
+            matches = {identifier: [] for identifier in self.identifiers}
+            self.finish_matching_job(job, self._record_sweep(job, matches))
+            return
+
+        chord(shards)(
+            tasks.CollectMatchShards.s(
+                sealed_identifiers, job.id, admin_email_template_name
+            ).on_error(tasks.FailMatchingJob.si(job.id))
+        )
+
+    def match_shard(self, sealed_identifiers, first_id, last_id):
+        """
+        Tries the identifiers on the MatchReports with ids from first_id to
+        last_id. Runs in a shard task.
+
+        Returns the number of rows scanned, and sealed per identifier, the id
+        and decrypted text of each MatchReport it decrypts
+        """
+        self.identifiers = unseal_identifiers(sealed_identifiers)
+        engine = self.matching_engine
+        decrypted = engine.decryptable_many(
+            self.match_reports.filter(pk__range=(first_id, last_id)).iterator(
+                chunk_size=getattr(settings, "MATCHING_CHUNK_SIZE", 2000)
+            ),
+            self.identifiers,
+        )
+        return {
+            "rows_scanned": engine.rows_scanned,
+            "matches": seal(
+                [
+                    [
+                        [match_report.pk, match_report.get_match(identifier)]
+                        for match_report in self._transform(
+                            identifier, decrypted[identifier], self.shard_transforms
+                        )
+                    ]
+                    for identifier in self.identifiers
+                ]
+            ),
+        }
+
+    def collect_shards(
+        self, shard_results, sealed_identifiers, job_id, admin_email_template_name=""
+    ):
+        """
+        Runs the transforms on the candidates of every shard, then notifies
+        the matches and finishes the MatchingJob. Runs in the chord callback.
+        """
+        from callisto_core.delivery.models import MatchingJob
+
+        job = MatchingJob.objects.get(pk=job_id)
+        self.identifiers = unseal_identifiers(sealed_identifiers)
+        try:
+            matches = self._record_sweep(job, self._collect(shard_results))
+            self.finish_matching_job(job, matches, admin_email_template_name)
+        except Exception:
+            job.fail()
+            raise
+
+    def _collect(self, shard_results):
+        """
+        Returns a dict of identifier => match list, for the candidates from
+        every shard
+        """
+        shard_matches = [unseal(shard["matches"]) for shard in shard_results]
+        self.rows_scanned = sum(shard["rows_scanned"] for shard in shard_results)
+        self.decrypted_match_reports = self._match_lists(
+            [
+                [candidate for matches in shard_matches for candidate in matches[index]]
+                for index in range(len(self.identifiers))
+            ]
+        )
+        self._share_reports(self.decrypted_match_reports.values())
+        return {
+            identifier: self._transform(
+                identifier, self.decrypted_match_reports[identifier]
+            )
+            for identifier in self.identifiers
+        }
+
+    def _shards(self):
+        bounds = self.match_reports.aggregate(first_id=Min("pk"), last_id=Max("pk"))
+        if bounds["first_id"] is None:
+            return []
+        return [
+            (first_id, min(first_id + self.shard_size - 1, bounds["last_id"]))
+            for first_id in range(
+                bounds["first_id"], bounds["last_id"] + 1, self.shard_size
+            )
+        ]
+
+    def _match_lists(self, candidates):
+        """
+        loads the MatchReports for lists of (id, decrypted text) pairs, one
+        list per identifier. The text decrypted by the shards is kept on each
+        MatchReport, so get_match doesn't stretch the identifier again
+        """
+        match_reports = self.match_reports.in_bulk(
+            {pk for match_list in candidates for pk, _ in match_list}
+        )
+        match_lists = {}
+        for index, identifier in enumerate(self.identifiers):
+            match_lists[identifier] = []
+            for pk, decrypted in candidates[index]:
+                if pk in match_reports:
+                    match_reports[pk].remember_match(identifier, decrypted)
+                    match_lists[identifier].append(match_reports[pk])
+        return match_lists
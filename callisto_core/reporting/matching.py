@@ -0,0 +1,210 @@
+"""
+
+Matching engines try identifiers against a list of candidate MatchReports,
+and return the MatchReports that each identifier decrypts.
+
+Candidates are consumed as a stream, so a sweep over a queryset iterator
+only holds a bounded number of MatchReports in memory at once.
+
+Key stretching dominates the cost of matching, and every candidate needs
+its own stretch, so the parallel engine spreads candidates across a process
+pool. Configure it with:
+
+    MATCHING_WORKERS = 1  # processes, 1 runs matching serially in-process
+    MATCHING_MEMORY_BUDGET = None  # KiB, caps workers * ARGON2_MEM_COST
+
+Workers are always forked, whatever the default start method is, so they
+inherit the configured settings and hashers. Where processes can't be
+forked, matching runs serially.
+
+"""
+import collections
+import itertools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from nacl.exceptions import CryptoError
+
+from django.conf import settings
+
+from callisto_core.delivery import hashers, security
+
+logger = logging.getLogger(__name__)
+
+
+def _decrypt_chunk(chunk, identifiers):
+    """runs in a worker process, so only receives plain match report columns"""
+    return [
+        security.decrypt_with_identifiers(
+            encode_prefix, salt, encrypted, [identifiers[index] for index in indexes]
+        )
+        for (encode_prefix, salt, encrypted, indexes) in chunk
+    ]
+
+
+def worker_count(memory_cost=None):
+    """
+    The number of matching processes to run, kept low enough that every
+    worker running an Argon2 derivation at once stays within
+    settings.MATCHING_MEMORY_BUDGET. memory_cost defaults to the configured
+    ARGON2_MEM_COST
+    """
+    workers = max(1, getattr(settings, "MATCHING_WORKERS", 1))
+    budget = getattr(settings, "MATCHING_MEMORY_BUDGET", None)
+    if budget:
+        if memory_cost is None:
+            try:
+                memory_cost = hashers.get_hasher("argon2").memory_cost
+            except ValueError:
+                return workers  # argon2 is not configured, nothing to budget for
+        workers = min(workers, max(1, budget // memory_cost))
+    return workers
+
+
+def can_fork_workers():
+    """
+    fork isn't available everywhere (ie. on Windows), and daemonic
+    processes can't have children
+    """
+    return (
+        "fork" in multiprocessing.get_all_start_methods()
+        and not multiprocessing.current_process().daemon
+    )
+
+
+def get_engine():
+    workers = worker_count()
+    if workers > 1 and can_fork_workers():
+        return ProcessPoolMatchingEngine(workers)
+    else:
+        return SerialMatchingEngine()
+
+
+class SerialMatchingEngine(object):
+    def decryptable(self, match_reports, identifier):
+        return self.decryptable_many(match_reports, [identifier])[identifier]
+
+    def decryptable_many(self, match_reports, identifiers, last_swept_ids=None):
+        """
+        Tries every identifier against every match report, in a single pass
+        over the match reports. Each report is only unpeppered and has its
+        encode prefix parsed once. An identifier is not tried against match
+        reports at or below its entry in last_swept_ids.
+
+        Returns a dict of identifier => decryptable match reports, with match
+        reports in the same order as the input
+        """
+        matches = {identifier: [] for identifier in identifiers}
+        for match_report, encrypted, indexes in self._candidates(
+            match_reports, identifiers, last_swept_ids
+        ):
+            results = security.decrypt_with_identifiers(
+                match_report.encode_prefix,
+                match_report.salt,
+                encrypted,
+                [identifiers[index] for index in indexes],
+            )
+            self._collect(matches, match_report, identifiers, indexes, results)
+        return matches
+
+    def _candidates(self, match_reports, identifiers, last_swept_ids=None):
+        """
+        yields each match report with its unpeppered text, and the indexes of
+        the identifiers to try on it. the pepper is removed here, so it never
+        has to leave this process
+        """
+        self.rows_scanned = 0
+        buckets = [security.match_bucket(identifier) for identifier in identifiers]
+        last_swept_ids = last_swept_ids or [0] * len(identifiers)
+        for match_report in match_reports:
+            self.rows_scanned += 1
+            indexes = [
+                index
+                for index, bucket in enumerate(buckets)
+                if match_report.pk > last_swept_ids[index]
+                and match_report.may_be_in_bucket(bucket)
+            ]
+            if not indexes:
+                continue
+            try:
+                encrypted = security.unpepper(match_report.encrypted)
+            except CryptoError:
+                continue
+            yield match_report, encrypted, indexes
+
+    def _collect(self, matches, match_report, identifiers, indexes, results):
+        for index, decrypted in zip(indexes, results):
+            if decrypted is not None:
+                identifier = identifiers[index]
+                match_report.backfill_bucket(identifier)
+                match_report.remember_match(identifier, decrypted)
+                matches[identifier].append(match_report)
+
+
+class ProcessPoolMatchingEngine(SerialMatchingEngine):
+    # candidates per chunk, small chunks balance uneven key stretching costs
+    chunk_size = 25
+    # chunks per worker submitted ahead, which bounds the candidates in memory
+    chunks_in_flight = 2
+
+    def __init__(self, workers):
+        self.workers = workers
+
+    def decryptable_many(self, match_reports, identifiers, last_swept_ids=None):
+        matches = {identifier: [] for identifier in identifiers}
+        chunks = self._chunk(
+            self._candidates(match_reports, identifiers, last_swept_ids)
+        )
+        first_chunk = next(chunks, [])
+        if len(first_chunk) < min(self.workers, self.chunk_size):
+            # the only chunk, and too small to be worth starting the pool
+            self._collect_chunk(
+                matches,
+                identifiers,
+                first_chunk,
+                _decrypt_chunk(self._columns(first_chunk), identifiers),
+            )
+            return matches
+
+        pending = collections.deque()
+        with ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            for chunk in itertools.chain([first_chunk], chunks):
+                future = executor.submit(
+                    _decrypt_chunk, self._columns(chunk), identifiers
+                )
+                pending.append((chunk, future))
+                if len(pending) >= self.workers * self.chunks_in_flight:
+                    self._collect_future(matches, identifiers, *pending.popleft())
+            # collected in submission order, so output order matches input order
+            while pending:
+                self._collect_future(matches, identifiers, *pending.popleft())
+        logger.debug(
+            f"matched {self.rows_scanned} reports across {self.workers} processes"
+        )
+        return matches
+
+    def _chunk(self, candidates):
+        chunk = []
+        for candidate in candidates:
+            chunk.append(candidate)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _columns(self, chunk):
+        return [
+            (match_report.encode_prefix, match_report.salt, encrypted, indexes)
+            for match_report, encrypted, indexes in chunk
+        ]
+
+    def _collect_future(self, matches, identifiers, chunk, future):
+        self._collect_chunk(matches, identifiers, chunk, future.result())
+
+    def _collect_chunk(self, matches, identifiers, chunk, results):
+        for (match_report, _, indexes), row_results in zip(chunk, results):
+            self._collect(matches, match_report, identifiers, indexes, row_results)
@@ -0,0 +1,54 @@
+import logging
+
+from callisto_core.celeryconfig.celery import celery_app
+from callisto_core.celeryconfig.tasks import CallistoCoreBaseTask
+from callisto_core.delivery.models import MatchingJob
+from callisto_core.utils.api import MatchingApi
+
+logger = logging.getLogger(__name__)
+
+
+class _RunMatchingJob(CallistoCoreBaseTask):
+    def _setUp(self, job_id, admin_email_template_name):
+        self.job = MatchingJob.objects.select_related("report").get(pk=job_id)
+        self.admin_email_template_name = admin_email_template_name
+
+    def _run_job(self):
+        self.job.start()
+        try:
+            MatchingApi.run_matching_job(self.job, self.admin_email_template_name)
+        except Exception:
+            self.job.fail()
+            raise
+
+
+@celery_app.task(base=_RunMatchingJob, bind=True)
+def RunMatchingJob(self, job_id, admin_email_template_name=""):
+    """
+    Runs a queued matching job, and sends notifications for its matches.
+    With DistributedMatchingApi, the job is finished by CollectMatchShards
+    """
+    self._setUp(job_id, admin_email_template_name)
+    self._run_job()
+
+
+@celery_app.task(base=CallistoCoreBaseTask, bind=True)
+def MatchShard(self, sealed_identifiers, first_id, last_id):
+    """Tries identifiers on one shard of the MatchReport id range"""
+    return MatchingApi.match_shard(sealed_identifiers, first_id, last_id)
+
+
+@celery_app.task(base=CallistoCoreBaseTask, bind=True)
+def CollectMatchShards(
+    self, shard_results, sealed_identifiers, job_id, admin_email_template_name=""
+):
+    """Finds the matches across every shard, and finishes the matching job"""
+    MatchingApi.collect_shards(
+        shard_results, sealed_identifiers, job_id, admin_email_template_name
+    )
+
+
+@celery_app.task(base=CallistoCoreBaseTask, bind=True)
+def FailMatchingJob(self, job_id):
+    """Marks a matching job failed, when one of its shard tasks fails"""
+    MatchingJob.objects.get(pk=job_id).fail()
@@ -20,7 +20,9 @@ and should not define:
     - url names
 
 """
+
 from django.contrib.auth.views import PasswordResetView
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.shortcuts import redirect
 from django.urls import reverse
@@ -30,9 +32,10 @@ from django.views.generic.edit import FormView
 
 from callisto_core.accounts import forms as account_forms, tokens as account_tokens
 from callisto_core.delivery import view_partials as delivery_partials
-from callisto_core.utils.api import MatchingApi, NotificationApi, TenantApi
+from callisto_core.delivery.models import MatchingJob
+from callisto_core.utils.api import NotificationApi, TenantApi
 
-from . import forms, view_helpers
+from . import forms, tasks, view_helpers
 
 
 class _SubmissionPartial(
@@ -191,42 +194,47 @@ class _ReportSubclassPartial(_SubmissionPartial):
 
 
 class _MatchingPartial(_ReportSubclassPartial):
+    admin_email_template_name = ""
+    # match notifications moved to NotificationApi.send_match_notifications
+    removed_notification_hooks = (
+        "_notify_authority_of_matches",
+        "_notify_owners_of_matches",
+        "_slack_match_notification",
+        "_match_confirmation_email_to_callisto",
+    )
+
+    def __init_subclass__(cls, **kwargs):
+        # fail loudly, rather than silently skip the customization
+        super().__init_subclass__(**kwargs)
+        for hook in cls.removed_notification_hooks:
+            if hook in vars(cls):
+                raise TypeError(
+                    f"{cls.__name__}.{hook} is no longer called, matches are "
+                    "notified in the background by "
+                    "NotificationApi.send_match_notifications, "
+                    "override that instead"
+                )
+
     def form_valid(self, form):
         response = super().form_valid(form)
         identifiers = form.cleaned_data.get("identifiers")
 
         self._notify_owner_of_submission(identifiers)
-        for identifier in identifiers:
-            matches = self._get_matches(identifier)
-
-            if matches:
-                self._notify_authority_of_matches(matches, identifier)
-                self._notify_owners_of_matches(matches)
-                self._slack_match_notification()
-                self._match_confirmation_email_to_callisto(matches)
+        self._enqueue_matching_job(identifiers)
 
         return response
 
-    def _get_matches(self, identifier):
-        return MatchingApi.find_matches(identifier)
-
-    def _slack_match_notification(self):
-        if not self.in_demo_mode:
-            NotificationApi.slack_notification(
-                msg="New Callisto Matches (details will be sent via email)",
-                type="match_confirmation",
-            )
-
-    def _match_confirmation_email_to_callisto(self, matches):
-        if not self.in_demo_mode:
-            NotificationApi.send_with_kwargs(
-                site_id=self.site_id,  # required in general
-                email_template_name=self.admin_email_template_name,  # the email template
-                to_addresses=NotificationApi.ALERT_LIST,  # addresses to send to
-                matches=matches,  # used in the email body
-                email_subject="New Callisto Matches",  # rendered as the email subject
-                email_name="match_confirmation_callisto_team",  # used in test assertions
-            )
+    def _enqueue_matching_job(self, identifiers):
+        """matching and match notifications run in the background"""
+        if not identifiers:
+            return
+        job = MatchingJob(report=self.report, site_id=self.site_id)
+        job.set_identifiers(list(identifiers))
+        job.save()
+        # the worker needs to see the job and the match report just saved
+        transaction.on_commit(
+            lambda: tasks.RunMatchingJob.delay(job.id, self.admin_email_template_name)
+        )
 
     def _notify_owner_of_submission(self, identifier):
         if identifier:
@@ -236,18 +244,6 @@ class _MatchingPartial(_ReportSubclassPartial):
                 site_id=self.site_id,
             )
 
-    def _notify_authority_of_matches(self, matches, identifier):
-        NotificationApi.send_matching_report_to_authority(
-            matches=matches,
-            identifier=identifier,
-            to_addresses=self.coordinator_emails,
-            public_key=self.coordinator_public_key,
-        )
-
-    def _notify_owners_of_matches(self, matches):
-        for match in matches:
-            NotificationApi.send_match_notification(match_report=match)
-
 
 class OptionalMatchingPartial(_MatchingPartial):
     EVAL_ACTION_TYPE = "ENTER_MATCHING_OPTIONAL"
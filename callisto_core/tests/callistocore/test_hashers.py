@@ -1,11 +1,21 @@
 import base64
+import threading
+import time
+from io import StringIO
+
+from mock import patch
+from nacl.exceptions import CryptoError
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
 from django.test import TestCase, override_settings
 from django.utils.encoding import force_bytes
 
 import callisto_core.delivery.hashers as hashers
+from callisto_core.delivery.models import Report
 
 
 class KeyHasherFunctionsTest(TestCase):
@@ -63,6 +73,42 @@ class KeyHasherFunctionsTest(TestCase):
         self.assertIsInstance(hs.pop(), hashers.PBKDF2KeyHasher)
         self.assertIsInstance(hs.pop(), hashers.PBKDF2KeyHasher)
 
+    def test_hashers_are_built_once(self):
+        self.assertIs(hashers.get_hasher(), hashers.get_hasher())
+        self.assertIs(hashers.get_hasher("argon2"), hashers.get_hasher("argon2"))
+
+    def test_hashers_are_rebuilt_on_settings_change(self):
+        hasher = hashers.get_hasher()
+        with override_settings(
+            KEY_HASHERS=["callisto_core.delivery.hashers.PBKDF2KeyHasher"]
+        ):
+            self.assertIsInstance(hashers.get_hasher(), hashers.PBKDF2KeyHasher)
+            with self.assertRaises(ValueError):
+                hashers.get_hasher("argon2")
+        self.assertIsNot(hashers.get_hasher(), hasher)
+        self.assertIsInstance(hashers.get_hasher(), hashers.Argon2KeyHasher)
+
+    @override_settings(ARGON2_TIME_COST=7, KEY_ITERATIONS=123)
+    def test_hasher_parameters_follow_settings(self):
+        self.assertEqual(hashers.get_hasher("argon2").time_cost, 7)
+        self.assertIn("t=7", hashers.current_prefix())
+        self.assertEqual(
+            hashers.get_hasher("pbkdf2_sha256").parameters_prefix(),
+            "pbkdf2_sha256$123$",
+        )
+
+    def test_must_update_legacy_and_outdated_prefixes(self):
+        self.assertTrue(hashers.must_update(None))
+        self.assertTrue(hashers.must_update(""))
+        self.assertTrue(hashers.must_update("pbkdf2_sha256$100$a_salt_probably"))
+        self.assertTrue(hashers.must_update("argon2$argon2i$v=19$m=512,t=9,p=2$salt"))
+
+    def test_current_prefix_is_not_updated(self):
+        hasher = hashers.get_hasher()
+        prefix, _ = hasher.split_encoded(hasher.encode("key", "a salt probably"))
+        self.assertTrue(prefix.startswith(hashers.current_prefix()))
+        self.assertFalse(hashers.must_update(prefix))
+
 
 class PBKDF2KeyHasherTest(TestCase):
     def setUp(self):
@@ -92,6 +138,10 @@ class PBKDF2KeyHasherTest(TestCase):
         self.assertTrue(self.hasher.must_update(prefix_more))
         self.assertFalse(self.hasher.must_update(prefix_same))
 
+    def test_parameters_prefix(self):
+        encoded = self.hasher.encode("this is definitely a key", "a salt probably")
+        self.assertTrue(encoded.startswith(self.hasher.parameters_prefix()))
+
     def test_verify_encoded(self):
         encoded = self.hasher.encode("this is definitely a key", "yup that's salt")
         correct = self.hasher.verify("this is definitely a key", encoded)
@@ -146,6 +196,19 @@ class Argon2KeyHasherTest(TestCase):
         self.assertTrue(correct)
         self.assertFalse(incorrect)
 
+    def test_parameters_prefix(self):
+        encoded = self.hasher.encode("this is definitely a key", "a salt probably")
+        prefix, _ = self.hasher.split_encoded(encoded)
+        self.assertEqual(
+            prefix, "{}a salt probably".format(self.hasher.parameters_prefix())
+        )
+
+    def test_keys_stretch_with_the_parameters_of_their_prefix(self):
+        encoded = self.hasher.encode("key", "a salt probably", time_cost=3)
+        prefix, stretched = self.hasher.split_encoded(encoded)
+        self.assertNotEqual(self.hasher.time_cost, 3)
+        self.assertEqual(hashers.make_key(prefix, "key", None), (prefix, stretched))
+
     def test_split_encoded_returns_correct_prefix(self):
         encoded = self.hasher.encode("this is definitely a key", "also here is a salt")
         prefix, stretched = self.hasher.split_encoded(encoded)
@@ -162,3 +225,174 @@ class Argon2KeyHasherTest(TestCase):
         encoded = self.hasher.encode("Yet Another Test Key", "salt for humans")
         prefix, stretched = self.hasher.split_encoded(encoded)
         self.assertEqual(len(stretched), 32)
+
+
+class RequestKeyMemoTest(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="test", password="test")
+        self.report = Report.objects.create(owner=user)
+        self.report.encrypt_record({"data": "a record"}, "a passphrase")
+
+    def tearDown(self):
+        hashers.clear_key_memo()
+
+    def stretch_count(self, func):
+        with patch.object(
+            hashers, "stretch_key", side_effect=hashers.stretch_key
+        ) as stretch_key:
+            func()
+        return stretch_key.call_count
+
+    def decrypt_twice(self):
+        report = Report.objects.get(pk=self.report.pk)
+        report.decrypt_record("a passphrase")
+        report.decrypt_record("a passphrase")
+
+    def test_key_stretched_once_per_request(self):
+        request_started.send(sender=self.__class__)
+        self.assertEqual(self.stretch_count(self.decrypt_twice), 1)
+
+    def test_key_stretched_every_time_outside_requests(self):
+        self.assertEqual(self.stretch_count(self.decrypt_twice), 2)
+
+    def test_keys_forgotten_after_response(self):
+        request_started.send(sender=self.__class__)
+        self.decrypt_twice()
+        request_finished.send(sender=self.__class__)
+        request_started.send(sender=self.__class__)
+        self.assertEqual(self.stretch_count(self.decrypt_twice), 1)
+
+    def test_other_passphrases_are_stretched(self):
+        request_started.send(sender=self.__class__)
+        self.report.decrypt_record("a passphrase")
+        with self.assertRaises(CryptoError):
+            self.report.decrypt_record("another passphrase")
+
+    def test_new_encryption_is_remembered(self):
+        request_started.send(sender=self.__class__)
+        self.report.encrypt_record({"data": "a new record"}, "a passphrase")
+        self.assertEqual(
+            self.stretch_count(lambda: self.report.decrypt_record("a passphrase")), 0
+        )
+
+
+class KeyDerivationExecutorTest(TestCase):
+    def setUp(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def block(self):
+        self.started.set()
+        self.release.wait(5)
+        return "unblocked"
+
+    def run_in_background(self, executor, memory_kib=0):
+        thread = threading.Thread(target=executor.run, args=(memory_kib, self.block))
+        thread.start()
+        self.started.wait(5)
+        return thread
+
+    def test_returns_derivation_result(self):
+        executor = hashers.KeyDerivationExecutor(workers=1, queue_depth=0)
+        self.assertEqual(executor.run(0, sum, [1, 2]), 3)
+
+    def test_fails_fast_past_queue_depth(self):
+        executor = hashers.KeyDerivationExecutor(
+            workers=1, queue_depth=0, retry_after=7
+        )
+        thread = self.run_in_background(executor)
+        with self.assertRaises(hashers.KeyDerivationBusy) as cm:
+            executor.run(0, sum, [1, 2])
+        self.assertEqual(cm.exception.retry_after, 7)
+        self.release.set()
+        thread.join()
+        self.assertEqual(executor.run(0, sum, [1, 2]), 3)
+
+    def test_memory_budget_limits_concurrent_derivations(self):
+        executor = hashers.KeyDerivationExecutor(
+            workers=2, queue_depth=2, memory_budget=100
+        )
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def derive():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        threads = [
+            threading.Thread(target=executor.run, args=(100, derive)) for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 1)
+
+    def test_make_key_raises_when_busy(self):
+        executor = hashers.KeyDerivationExecutor(workers=1, queue_depth=0)
+        thread = self.run_in_background(executor)
+        with patch.object(hashers, "get_kdf_executor", return_value=executor):
+            with self.assertRaises(hashers.KeyDerivationBusy):
+                hashers.make_key(None, "key", "salt")
+            with self.assertRaises(hashers.KeyDerivationBusy):
+                hashers.get_hasher("argon2").encode("key", "a salt probably")
+        self.release.set()
+        thread.join()
+
+    def test_executor_rebuilt_on_settings_change(self):
+        executor = hashers.get_kdf_executor()
+        self.assertIs(hashers.get_kdf_executor(), executor)
+        with override_settings(KDF_QUEUE_DEPTH=1):
+            self.assertIsNot(hashers.get_kdf_executor(), executor)
+
+    def test_replaced_executor_is_shut_down(self):
+        executor = hashers.get_kdf_executor()
+        with patch.object(executor, "shutdown") as shutdown:
+            with override_settings(KDF_WORKERS=1):
+                shutdown.assert_called_once_with()
+
+
+class CalibrateKDFTest(TestCase):
+    def calibrate(self, **options):
+        stdout = StringIO()
+        call_command(
+            "calibrate_kdf",
+            samples=2,
+            time_costs=[1, 2],
+            memory_costs=[512],
+            iterations=[100, 200],
+            stdout=stdout,
+            **options,
+        )
+        return stdout.getvalue()
+
+    def test_reports_every_parameter_set(self):
+        output = self.calibrate(match_reports=10)
+        self.assertIn("time_cost=1,memory_cost=512", output)
+        self.assertIn("time_cost=2,memory_cost=512", output)
+        self.assertIn("iterations=100", output)
+        self.assertIn("iterations=200", output)
+
+    def test_suggests_strongest_parameters_within_targets(self):
+        output = self.calibrate(match_reports=10, target_ms=10000)
+        self.assertIn("ARGON2_TIME_COST = 2", output)
+        self.assertIn("ARGON2_MEM_COST = 512", output)
+        self.assertIn("KEY_ITERATIONS = 200", output)
+
+    def test_no_suggestion_when_targets_are_unreachable(self):
+        output = self.calibrate(match_reports=10, target_ms=0)
+        self.assertIn("no argon2 parameters met both targets", output)
+        self.assertIn("no pbkdf2 parameters met both targets", output)
+
+    @override_settings(MATCH_BUCKET_LENGTH=1)
+    def test_sweep_projection_counts_one_bucket(self):
+        output = self.calibrate(match_reports=160)
+        self.assertIn("Projecting sweeps over 160 match reports, 10 of them", output)
@@ -1,6 +1,13 @@
+import json
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import override_settings
 
+from callisto_core.delivery import hashers, security
 from callisto_core.delivery.models import (
+    FormSchemaSnapshot,
     MatchReport,
     Report,
     SentFullReport,
@@ -13,6 +20,15 @@ from .models import LegacyMatchReportData, LegacyReportData
 User = get_user_model()
 
 
+class CallistoDecryptableReport(Report):
+    class Meta:
+        app_label = "delivery"
+        proxy = True
+
+    def _store_for_callisto_decryption(self, record_data):
+        self.stored.append(record_data)
+
+
 class ReportModelTest(test_base.ReportFlowHelper):
     def test_reports_have_owners(self):
         report = Report()
@@ -55,6 +71,216 @@ class ReportModelTest(test_base.ReportFlowHelper):
             "this text should be encrypted otherwise bad things",
         )
 
+    def test_rewrite_keeps_encode_prefix(self):
+        report = Report(owner=self.user)
+        report.encrypt_record("first draft", "key")
+        encode_prefix = report.encode_prefix
+        report.encrypt_record("second draft", "key")
+        report.refresh_from_db()
+        self.assertEqual(report.encode_prefix, encode_prefix)
+        self.assertEqual(report.decrypt_record("key"), "second draft")
+
+    def test_rewrite_reuses_stretched_key(self):
+        report = Report(owner=self.user)
+        hashers.start_key_memo()
+        try:
+            report.encrypt_record("first draft", "key")
+            with patch.object(
+                hashers, "stretch_key", wraps=hashers.stretch_key
+            ) as stretch_key, self.assertNumQueries(4):
+                # the save and the answer delta delete, in a savepoint
+                report.encrypt_record("second draft", "key")
+        finally:
+            hashers.clear_key_memo()
+        stretch_key.assert_not_called()
+
+    def test_rewrite_uses_fresh_nonce(self):
+        report = Report(owner=self.user)
+        report.encrypt_record("draft", "key")
+        encrypted = bytes(report.encrypted)
+        report.encrypt_record("draft", "key")
+        self.assertNotEqual(bytes(report.encrypted), encrypted)
+
+    def test_rotate_key_generates_new_salt(self):
+        report = Report(owner=self.user)
+        report.encrypt_record("first draft", "key")
+        encode_prefix = report.encode_prefix
+        report.encrypt_record("second draft", "key", rotate_key=True)
+        report.refresh_from_db()
+        self.assertNotEqual(report.encode_prefix, encode_prefix)
+        self.assertEqual(report.decrypt_record("key"), "second draft")
+
+    def test_rewrite_rotates_outdated_encode_prefix(self):
+        report = Report(owner=self.user)
+        with override_settings(
+            KEY_HASHERS=["callisto_core.delivery.hashers.PBKDF2KeyHasher"]
+        ):
+            report.encrypt_record("first draft", "key")
+        report.encrypt_record("second draft", "key")
+        self.assertFalse(hashers.must_update(report.encode_prefix))
+        self.assertEqual(report.decrypt_record("key"), "second draft")
+
+    def test_records_are_compressed(self):
+        record_data = {"data": {}, "wizard_form_serialized": ["<p>question</p>"] * 50}
+        report = Report(owner=self.user)
+        report.encrypt_record(record_data, "key")
+        report.refresh_from_db()
+        self.assertLess(len(report.encrypted), len(json.dumps(record_data)) / 4)
+        self.assertEqual(report.decrypt_record("key"), record_data)
+
+    def test_form_schema_is_stored_separately(self):
+        schema = [{"question": "<p>question</p>"}] * 50
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}, "wizard_form_serialized": schema}, "key")
+        report.refresh_from_db()
+        self.assertLess(len(report.encrypted), 200)
+        self.assertEqual(
+            report.decrypt_record("key"), {"data": {}, "wizard_form_serialized": schema}
+        )
+
+    def test_reports_share_form_schema_snapshots(self):
+        schema = [{"question": "<p>question</p>"}]
+        for answer in ["yes", "no"]:
+            report = Report(owner=self.user)
+            report.encrypt_record(
+                {"data": {"1": answer}, "wizard_form_serialized": schema}, "key"
+            )
+        self.assertEqual(FormSchemaSnapshot.objects.count(), 1)
+
+    def test_form_schema_snapshots_are_cached(self):
+        schema = [{"question": "<p>question</p>"}]
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}, "wizard_form_serialized": schema}, "key")
+        report.decrypt_record("key")
+        with self.assertNumQueries(0):
+            record_data = report.decrypt_record("key")
+        record_data["wizard_form_serialized"].append("changed")
+        self.assertEqual(report.decrypt_record("key")["wizard_form_serialized"], schema)
+
+    def test_altered_form_schema_snapshots_fail(self):
+        schema = [{"question": "<p>an altered question</p>"}]
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}, "wizard_form_serialized": schema}, "key")
+        FormSchemaSnapshot.objects.update(
+            schema=json.dumps([{"question": "<p>another question</p>"}])
+        )
+        with self.assertRaises(ValueError):
+            report.decrypt_record("key")
+
+    def test_answers_are_added_as_deltas(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {"1": "yes"}}, "key")
+        encrypted = report.encrypted
+        report.add_answers({"2": "no"}, "key")
+        report.add_answers({"1": "maybe"}, "key")
+        report.refresh_from_db()
+        self.assertEqual(report.encrypted, encrypted)
+        self.assertEqual(report.answer_deltas.count(), 2)
+        self.assertEqual(
+            report.decrypt_record("key"), {"data": {"1": "maybe", "2": "no"}}
+        )
+
+    @override_settings(RECORD_COMPACTION_DELTAS=3)
+    def test_answer_deltas_are_compacted(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}}, "key")
+        for answer in ["a", "b", "c"]:
+            report.add_answers({answer: answer}, "key")
+        report.refresh_from_db()
+        self.assertEqual(report.answer_delta_count, 0)
+        self.assertFalse(report.answer_deltas.exists())
+        self.assertEqual(
+            report.decrypt_record("key"), {"data": {"a": "a", "b": "b", "c": "c"}}
+        )
+
+    def test_rewrite_replaces_answer_deltas(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}}, "key")
+        report.add_answers({"1": "yes"}, "key")
+        report.encrypt_record({"data": {"1": "no"}}, "key", rotate_key=True)
+        self.assertFalse(report.answer_deltas.exists())
+        self.assertEqual(report.decrypt_record("key"), {"data": {"1": "no"}})
+
+    def test_answers_for_outdated_keys_rewrite_the_record(self):
+        report = Report(owner=self.user)
+        with override_settings(
+            KEY_HASHERS=["callisto_core.delivery.hashers.PBKDF2KeyHasher"]
+        ):
+            report.encrypt_record({"data": {}}, "key")
+        report.add_answers({"1": "yes"}, "key")
+        self.assertFalse(report.answer_deltas.exists())
+        self.assertFalse(hashers.must_update(report.encode_prefix))
+        self.assertEqual(report.decrypt_record("key"), {"data": {"1": "yes"}})
+
+    def test_answers_to_plain_text_reports_fail(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({}, "key")
+        _, key = hashers.make_key(report.encode_prefix, "key", None)
+        report.encrypted = security.encrypt_text(key, "a plain text report")
+        report.save()
+        with self.assertRaises(ValueError):
+            report.add_answers({"1": "yes"}, "key")
+        self.assertFalse(report.answer_deltas.exists())
+        self.assertEqual(report.decrypt_record("key"), "a plain text report")
+
+    def test_answers_rewrite_the_record_for_callisto_decryption(self):
+        report = CallistoDecryptableReport(owner=self.user)
+        report.stored = []
+        report.encrypt_record({"data": {}}, "key")
+        report.add_answers({"1": "yes"}, "key")
+        self.assertFalse(report.answer_deltas.exists())
+        self.assertEqual(report.stored[-1], {"data": {"1": "yes"}})
+
+    def test_answer_delta_is_not_kept_when_its_count_fails(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {"1": "yes"}}, "key")
+        with patch.object(Report, "save", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                report.add_answers({"1": "no"}, "key")
+        report = Report.objects.get(pk=report.pk)
+        self.assertEqual(report.answer_delta_count, 0)
+        self.assertFalse(report.answer_deltas.exists())
+        self.assertEqual(report.decrypt_record("key"), {"data": {"1": "yes"}})
+
+    def test_answer_delta_count_is_counted_in_the_database(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}}, "key")
+        concurrent_report = Report.objects.get(pk=report.pk)
+        report.add_answers({"1": "yes"}, "key")
+        concurrent_report.add_answers({"2": "no"}, "key")
+        self.assertEqual(concurrent_report.answer_delta_count, 2)
+        self.assertEqual(
+            Report.objects.get(pk=report.pk).decrypt_record("key"),
+            {"data": {"1": "yes", "2": "no"}},
+        )
+
+    def test_rewrite_deletes_uncounted_answer_deltas(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}}, "key")
+        report.answer_deltas.create(encrypted=b"an orphaned delta")
+        report.encrypt_record({"data": {"1": "yes"}}, "key")
+        self.assertFalse(report.answer_deltas.exists())
+
+    def test_rewrite_deletes_answer_deltas_atomically(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({"data": {}}, "key")
+        report.add_answers({"1": "yes"}, "key")
+        with patch.object(Report, "answer_deltas") as answer_deltas:
+            answer_deltas.all.return_value.delete.side_effect = RuntimeError
+            with self.assertRaises(RuntimeError):
+                report.encrypt_record({"data": {"1": "no"}}, "key")
+        report = Report.objects.get(pk=report.pk)
+        self.assertEqual(report.answer_delta_count, 1)
+        self.assertEqual(report.decrypt_record("key"), {"data": {"1": "yes"}})
+
+    def test_can_decrypt_uncompressed_reports(self):
+        report = Report(owner=self.user)
+        report.encrypt_record({}, "key")
+        _, key = hashers.make_key(report.encode_prefix, "key", None)
+        report.encrypted = security.encrypt_text(key, json.dumps({"data": {}}))
+        report.save()
+        self.assertEqual(report.decrypt_record("key"), {"data": {}})
+
     def test_no_times_by_default(self):
         report = Report(owner=self.user)
         report.encrypt_record("test report", "key")
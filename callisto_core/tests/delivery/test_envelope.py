@@ -0,0 +1,134 @@
+import json
+import zlib
+from io import StringIO
+from unittest import skipIf
+
+from mock import Mock, patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from callisto_core.delivery import envelope
+from callisto_core.tests.delivery import record_data
+
+
+class RecordEnvelopeTest(TestCase):
+    def dump(self, data, **kwargs):
+        return b"".join(envelope.dump_record(data, **kwargs))
+
+    def load(self, payload):
+        _, data = envelope.load_record([payload])
+        return data
+
+    def test_roundtrip(self):
+        payload = self.dump(record_data.EXPECTED_FORMSET)
+        self.assertTrue(envelope.is_envelope(payload))
+        self.assertEqual(self.load(payload), record_data.EXPECTED_FORMSET)
+
+    def test_loads_from_arbitrary_chunks(self):
+        payload = self.dump(record_data.EXPECTED_FORMSET)
+        chunks = [payload[i : i + 5] for i in range(0, len(payload), 5)]
+        _, data = envelope.load_record(chunks)
+        self.assertEqual(data, record_data.EXPECTED_FORMSET)
+
+    def test_body_is_decompressed_a_chunk_at_a_time(self):
+        payload = self.dump(record_data.EXPECTED_FORMSET)
+        chunks = [payload[i : i + 5] for i in range(0, len(payload), 5)]
+        decompressor = Mock(wraps=zlib.decompressobj())
+        with patch.object(envelope, "_decompressor", return_value=decompressor):
+            _, data = envelope.load_record(chunks)
+        self.assertEqual(data, record_data.EXPECTED_FORMSET)
+        self.assertTrue(
+            all(len(args[0]) <= 5 for args, _ in decompressor.decompress.call_args_list)
+        )
+
+    def test_header_describes_payload(self):
+        payload = self.dump({}, schema_ref="sha256:abc")
+        header, _ = envelope.load_record([payload])
+        self.assertEqual(
+            header,
+            envelope.Header(
+                envelope.ENVELOPE_VERSION,
+                envelope.CODEC_JSON,
+                envelope.COMPRESSION_ZLIB,
+                "sha256:abc",
+            ),
+        )
+
+    def test_compresses_repeated_question_text(self):
+        data = {
+            "data": {},
+            "wizard_form_serialized": [record_data.EXPECTED_FORMSET] * 20,
+        }
+        self.assertLess(len(self.dump(data)), len(json.dumps(data)) / 5)
+
+    def test_loads_version_1_envelopes(self):
+        body = zlib.compress(json.dumps(record_data.EXPECTED_FORMSET).encode("utf-8"))
+        payload = envelope.ENVELOPE_MARKER + bytes([1, envelope.COMPRESSION_ZLIB])
+        header, data = envelope.load_record([payload + body])
+        self.assertEqual(header.version, 1)
+        self.assertEqual(data, record_data.EXPECTED_FORMSET)
+
+    def test_loads_legacy_json(self):
+        payload = json.dumps(record_data.EXPECTED_SINGLE_LINE).encode("utf-8")
+        self.assertFalse(envelope.is_envelope(payload))
+        header, data = envelope.load_record([payload])
+        self.assertIsNone(header)
+        self.assertEqual(data, record_data.EXPECTED_SINGLE_LINE)
+
+    def test_loads_legacy_text(self):
+        self.assertEqual(self.load(b"a plain text report"), "a plain text report")
+
+    def test_unknown_version(self):
+        with self.assertRaises(ValueError):
+            self.load(envelope.ENVELOPE_MARKER + bytes([99, 1, 1, 0]))
+
+    @override_settings(RECORD_COMPRESSION="lzma")
+    def test_unknown_compression_setting(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.dump({})
+
+    @override_settings(RECORD_CODEC="pickle")
+    def test_unknown_codec_setting(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.dump({})
+
+    @skipIf(envelope.zstandard is None, "zstandard is not installed")
+    @override_settings(RECORD_COMPRESSION="zstd")
+    def test_zstd_roundtrip(self):
+        payload = self.dump(record_data.EXPECTED_FORMSET)
+        header, data = envelope.load_record([payload])
+        self.assertEqual(header.compression, envelope.COMPRESSION_ZSTD)
+        self.assertEqual(data, record_data.EXPECTED_FORMSET)
+
+    @skipIf(envelope.zstandard is not None, "zstandard is installed")
+    @override_settings(RECORD_COMPRESSION="zstd")
+    def test_zstd_requires_zstandard(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.dump({})
+
+    @skipIf(envelope.msgpack is None, "msgpack is not installed")
+    @override_settings(RECORD_CODEC="msgpack")
+    def test_msgpack_roundtrip(self):
+        payload = self.dump(record_data.EXPECTED_FORMSET)
+        header, data = envelope.load_record([payload])
+        self.assertEqual(header.codec, envelope.CODEC_MSGPACK)
+        self.assertEqual(data, record_data.EXPECTED_FORMSET)
+
+    @skipIf(envelope.msgpack is not None, "msgpack is installed")
+    @override_settings(RECORD_CODEC="msgpack")
+    def test_msgpack_requires_msgpack(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.dump({})
+
+
+class BenchmarkEnvelopesTest(TestCase):
+    def test_reports_every_codec_and_compression(self):
+        stdout = StringIO()
+        call_command("benchmark_envelopes", rounds=1, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertIn("4 records", output)
+        for codec in envelope.CODECS:
+            for compression in envelope.COMPRESSIONS:
+                self.assertRegex(output, f"{codec} +{compression}")
@@ -0,0 +1,85 @@
+import nacl.secret
+import nacl.utils
+from mock import patch
+from nacl.exceptions import CryptoError
+
+from django.test import TestCase
+
+from callisto_core.delivery import security
+
+
+class ChunkedEncryptionTest(TestCase):
+    key = b"k" * 32
+
+    def test_text_roundtrip(self):
+        encrypted = security.encrypt_text(self.key, '{"answer": "yes"}')
+        self.assertTrue(encrypted.startswith(security.STREAM_PREFIX))
+        self.assertEqual(
+            security.decrypt_text(self.key, encrypted), '{"answer": "yes"}'
+        )
+
+    def test_memoryview_roundtrip(self):
+        encrypted = security.encrypt_text(self.key, "stored in a BinaryField")
+        self.assertEqual(
+            security.decrypt_text(self.key, memoryview(encrypted)),
+            "stored in a BinaryField",
+        )
+
+    def test_empty_text_roundtrip(self):
+        encrypted = security.encrypt_text(self.key, "")
+        self.assertEqual(security.decrypt_text(self.key, encrypted), "")
+
+    @patch.object(security, "STREAM_CHUNK_SIZE", 5)
+    def test_multiple_chunk_roundtrip(self):
+        text = "a narrative with ✓ multibyte characters ✓ across chunks"
+        encrypted = security.encrypt_text(self.key, text)
+        self.assertEqual(security.decrypt_text(self.key, encrypted), text)
+
+    def test_chunks_may_be_split_anywhere(self):
+        encrypted = b"".join(
+            security.encrypt_chunks(self.key, [b"first chunk", b"second chunk"])
+        )
+        pieces = [encrypted[i : i + 7] for i in range(0, len(encrypted), 7)]
+        self.assertEqual(
+            list(security.decrypt_chunks(self.key, pieces)),
+            [b"first chunk", b"second chunk"],
+        )
+
+    def test_bytes_decrypt_a_chunk_at_a_time(self):
+        encrypted = b"".join(
+            security.encrypt_chunks(self.key, [b"first chunk", b"second chunk"])
+        )
+        chunks = security.decrypt_bytes(self.key, encrypted)
+        self.assertEqual(next(chunks), b"first chunk")
+        self.assertEqual(list(chunks), [b"second chunk"])
+
+    def test_wrong_key_fails(self):
+        encrypted = security.encrypt_text(self.key, "secret")
+        with self.assertRaises(CryptoError):
+            security.decrypt_text(b"x" * 32, encrypted)
+
+    def test_truncated_record_fails(self):
+        chunks = list(security.encrypt_chunks(self.key, [b"first", b"second"]))
+        with self.assertRaises(CryptoError):
+            security.decrypt_text(self.key, b"".join(chunks[:-1]))
+
+    def test_appended_data_fails(self):
+        encrypted = security.encrypt_text(self.key, "secret")
+        with self.assertRaises(CryptoError):
+            security.decrypt_text(self.key, encrypted + b"more")
+
+    def test_legacy_secretbox_records_decrypt(self):
+        box = nacl.secret.SecretBox(self.key)
+        nonce = nacl.utils.random(nacl.secret.SecretBox.NONCE_SIZE)
+        encrypted = box.encrypt("a legacy record".encode("utf-8"), nonce)
+        self.assertEqual(security.decrypt_text(self.key, encrypted), "a legacy record")
+
+    def test_legacy_nonce_with_stream_prefix_decrypts(self):
+        box = nacl.secret.SecretBox(self.key)
+        nonce = security.STREAM_PREFIX + nacl.utils.random(
+            nacl.secret.SecretBox.NONCE_SIZE - len(security.STREAM_PREFIX)
+        )
+        encrypted = box.encrypt("an unlucky legacy record".encode("utf-8"), nonce)
+        self.assertEqual(
+            security.decrypt_text(self.key, encrypted), "an unlucky legacy record"
+        )
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+from django.core.signals import request_finished, request_started
+from django.test import override_settings
+
+from callisto_core.delivery import models, view_helpers
+from callisto_core.tests import test_base
+from callisto_core.wizard_builder import view_partials as wizard_builder_partials
+
+
+class StorageHelperMemoTest(test_base.ReportFlowHelper):
+    def setUp(self):
+        super().setUp()
+        self.report = models.Report.objects.create(owner=self.user)
+        self.report.encrypt_record({"data": {"1": "yes"}}, self.passphrase)
+        view = SimpleNamespace(
+            report=self.report,
+            get_site_id=lambda: 1,
+            request=SimpleNamespace(session={}),
+        )
+        self.storage = view_helpers.EncryptedReportStorageHelper(view)
+        self.storage.passphrase = self.passphrase
+
+    def decrypt_count(self, func):
+        with override_settings(DEBUG=True):
+            models.start_decrypt_count()
+            func()
+            count = models.decrypt_count()
+            models.log_decrypt_count()
+        return count
+
+    def test_record_decrypted_once(self):
+        def read_twice():
+            self.storage.current_data_from_storage()
+            self.storage.current_data_from_storage()
+
+        self.assertEqual(self.decrypt_count(read_twice), 1)
+
+    def test_copies_are_independent(self):
+        self.storage.current_data_from_storage()["data"]["1"] = "changed"
+        self.assertEqual(self.storage.current_data_from_storage()["data"]["1"], "yes")
+
+    def test_add_data_invalidates(self):
+        self.storage.current_data_from_storage()
+        self.storage.add_data_to_storage({"1": "yes", "2": "no"})
+        self.assertEqual(
+            self.storage.current_data_from_storage()["data"], {"1": "yes", "2": "no"}
+        )
+
+    def test_decrypts_not_counted_without_debug(self):
+        models.start_decrypt_count()
+        self.report.decrypt_record(self.passphrase)
+        self.assertIsNone(models.decrypt_count())
+
+    @override_settings(DEBUG=True)
+    def test_request_decrypts_logged(self):
+        request_started.send(sender=self.__class__)
+        self.report.decrypt_record(self.passphrase)
+        with self.assertLogs("callisto_core.delivery.models", "DEBUG") as logs:
+            request_finished.send(sender=self.__class__)
+        self.assertIn("request decrypted records 1 times", logs.output[0])
+
+
+class WizardHelperMemoTest(test_base.ReportFlowHelper):
+    def test_helpers_built_once_per_view(self):
+        view = wizard_builder_partials.WizardPartial()
+        view.storage_helper = lambda view: object()
+        self.assertIs(view.storage, view.storage)
+        self.assertIs(view.steps, view.steps)
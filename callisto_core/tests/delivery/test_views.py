@@ -1,12 +1,12 @@
 from unittest import skip
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from django.core import mail
 from django.core.management import call_command
 from django.test.utils import override_settings
 from django.urls import reverse
 
-from callisto_core.delivery import forms, models
+from callisto_core.delivery import forms, hashers, models
 from callisto_core.tests import test_base
 from callisto_core.wizard_builder.forms import PageForm
 
@@ -164,3 +164,25 @@ class ReportMetaFlowTest(test_base.ReportFlowHelper):
         self.client_post_matching_enter()
         # TODO: new email assertions
         # self.match_report_email_assertions()
+
+
+class KeyDerivationBusyTest(test_base.ReportFlowHelper):
+    def setUp(self):
+        super().setUp()
+        self.client.login(username="testing_122", password="testing_12")
+        self.report = models.Report.objects.create(owner=self.user)
+        self.report.encrypt_record({}, self.passphrase)
+
+    def test_busy_key_derivation_returns_503(self):
+        with patch.object(
+            models.Report,
+            "decrypt_record",
+            side_effect=hashers.KeyDerivationBusy(retry_after=7),
+        ):
+            response = self.client.post(
+                reverse("report_delete", kwargs={"uuid": self.report.uuid}),
+                {"key": self.passphrase},
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(models.Report.objects.count(), 1)
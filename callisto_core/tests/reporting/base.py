@@ -31,10 +31,28 @@ class MatchSetup(TestCase):
         self.assert_matches_found(self.assertFalse)
 
     def assert_matches_found(self, assertion):
-        for match in MatchReport.objects.all():
+        for match in MatchReport.objects.with_match_found():
             assertion(match.match_found)
 
+    def assert_matches_found_true_for(self, identifier):
+        for match in MatchReport.objects.all():
+            if match.get_match(identifier):
+                self.assertTrue(match.match_found)
+            else:
+                self.assertFalse(match.match_found)
+
+    def match_pks(self, matches):
+        return {
+            identifier: [match_report.pk for match_report in match_list]
+            for identifier, match_list in matches.items()
+        }
+
     def create_match(self, user, identifier):
+        self.create_match_report(user, identifier)
+        matches = MatchingApi.find_matches(identifier)
+        return matches
+
+    def create_match_report(self, user, identifier):
         self.most_recent_report = Report(owner=user)
         self.most_recent_report.encrypt_record("test report 1", "key")
         match_report = MatchReport(report=self.most_recent_report)
@@ -47,6 +65,4 @@ class MatchSetup(TestCase):
         match_report.encrypt_match_report(
             json.dumps(match_report_content.__dict__), identifier
         )
-
-        matches = MatchingApi.find_matches(identifier)
-        return matches
+        return match_report
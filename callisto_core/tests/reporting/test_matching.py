@@ -1,16 +1,36 @@
 import json
+import multiprocessing
+from datetime import timedelta
+from io import StringIO
 from unittest import skip
 
 from mock import call, patch
 
 from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models.query import QuerySet
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from callisto_core.delivery.models import MatchReport
+from callisto_core.delivery import hashers, security
+from callisto_core.delivery.models import (
+    MatchingJob,
+    MatchingWatermark,
+    MatchReport,
+    Report,
+)
+from callisto_core.reporting import matching, tasks, view_partials
+from callisto_core.reporting.api import (
+    DistributedMatchingApi,
+    seal_identifiers,
+    unseal_identifiers,
+)
+from callisto_core.tests.callistocore.models import LegacyMatchReportData
 from callisto_core.tests.reporting.base import MatchSetup
 from callisto_core.tests.test_base import ReportPostHelper
-from callisto_core.tests.utils.api import CustomNotificationApi
+from callisto_core.tests.utils.api import CustomMatchingApi, CustomNotificationApi
 from callisto_core.utils.api import MatchingApi
 
 User = get_user_model()
@@ -83,6 +103,586 @@ class MatchAlertingTest(MatchSetup):
         self.assertFalse(matches)
 
 
+@override_settings(MATCH_BUCKET_LENGTH=8)
+class MatchBucketTest(MatchSetup):
+    def test_match_report_is_bucketed_on_encryption(self):
+        self.create_match(self.user1, "test1")
+        self.assertEqual(
+            MatchReport.objects.first().bucket, security.match_bucket("test1")
+        )
+
+    def test_other_buckets_are_not_candidates(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test2")
+        candidates = MatchReport.objects.in_bucket("test1")
+        self.assertEqual(candidates.count(), 1)
+        self.assertIsNotNone(candidates.first().get_match("test1"))
+
+    def test_other_buckets_are_not_decrypted(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test2")
+        with patch.object(
+            security, "decrypt_with_identifiers", return_value=[None]
+        ) as decrypt:
+            MatchingApi.find_matches("test1")
+        self.assertEqual(decrypt.call_count, 1)
+
+    def test_unbucketed_reports_are_backfilled_on_match(self):
+        self.create_match(self.user1, "test1")
+        MatchReport.objects.update(bucket=None)
+        self.assertEqual(MatchReport.objects.in_bucket("test2").count(), 1)
+        self.create_match(self.user2, "test1")
+        self.assertEqual(MatchReport.objects.filter(bucket=None).count(), 0)
+        self.assertEqual(MatchReport.objects.in_bucket("test2").count(), 0)
+
+    def test_narrower_buckets_are_truncated(self):
+        self.create_match(self.user1, "test1")
+        with self.settings(MATCH_BUCKET_LENGTH=4):
+            call_command("rebucket_match_reports", stdout=StringIO())
+            self.assertEqual(
+                MatchReport.objects.get().bucket, security.match_bucket("test1")
+            )
+            self.create_match(self.user2, "test1")
+        self.assert_matches_found_true()
+
+    def test_wider_buckets_are_backfilled(self):
+        with self.settings(MATCH_BUCKET_LENGTH=4):
+            self.create_match(self.user1, "test1")
+        call_command("rebucket_match_reports", stdout=StringIO())
+        self.assertEqual(MatchReport.objects.in_bucket("test2").count(), 1)
+        self.create_match(self.user2, "test1")
+        self.assertEqual(MatchReport.objects.in_bucket("test2").count(), 0)
+        self.assert_matches_found_true()
+
+    def test_bucket_lookup_is_not_a_scan(self):
+        query = str(MatchReport.objects.in_bucket("test1").query)
+        self.assertNotIn("LENGTH", query.upper())
+
+    def test_buckets_can_be_disabled(self):
+        with self.settings(MATCH_BUCKET_LENGTH=0):
+            self.create_match(self.user1, "test1")
+            self.create_match(self.user2, "test2")
+            self.assertIsNone(MatchReport.objects.first().bucket)
+            self.assertEqual(MatchReport.objects.in_bucket("test1").count(), 2)
+
+
+@override_settings(MATCHING_WORKERS=2)
+class ParallelMatchingTest(MatchSetup):
+    def test_parallel_engine_is_used(self):
+        self.assertIsInstance(matching.get_engine(), matching.ProcessPoolMatchingEngine)
+
+    def test_two_matching_reports_match(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test2")
+        self.create_match(self.user3, "test1")
+        self.assert_matches_found_true_for("test1")
+
+    def test_parallel_output_matches_serial_output(self):
+        for user, identifier in [
+            (self.user1, "test1"),
+            (self.user2, "test2"),
+            (self.user3, "test1"),
+            (self.user4, "test1"),
+            (self.user1, "test2"),
+        ]:
+            self.create_match(user, identifier)
+        match_reports = list(MatchReport.objects.order_by("pk"))
+        parallel = matching.ProcessPoolMatchingEngine(2).decryptable(
+            match_reports, "test1"
+        )
+        serial = matching.SerialMatchingEngine().decryptable(match_reports, "test1")
+        self.assertEqual(len(parallel), 3)
+        self.assertEqual(parallel, serial)
+
+    def test_workers_are_forked_under_another_start_method(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test1")
+        match_reports = list(MatchReport.objects.order_by("pk"))
+        start_method = multiprocessing.get_start_method()
+        multiprocessing.set_start_method("spawn", force=True)
+        try:
+            with patch.object(
+                matching, "ProcessPoolExecutor", wraps=matching.ProcessPoolExecutor
+            ) as executor:
+                parallel = matching.ProcessPoolMatchingEngine(2).decryptable(
+                    match_reports, "test1"
+                )
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+        self.assertEqual(len(parallel), 2)
+        mp_context = executor.call_args[1]["mp_context"]
+        self.assertEqual(mp_context.get_start_method(), "fork")
+
+    def test_serial_engine_is_used_without_fork(self):
+        with patch.object(
+            multiprocessing, "get_all_start_methods", return_value=["spawn"]
+        ):
+            self.assertIsInstance(matching.get_engine(), matching.SerialMatchingEngine)
+
+    @override_settings(MATCHING_WORKERS=16, MATCHING_MEMORY_BUDGET=2048)
+    def test_workers_are_limited_by_memory_budget(self):
+        # ARGON2_MEM_COST is 512 KiB in test settings
+        self.assertEqual(matching.worker_count(), 4)
+
+    @override_settings(MATCHING_WORKERS=16, MATCHING_MEMORY_BUDGET=1)
+    def test_workers_are_never_below_one(self):
+        self.assertEqual(matching.worker_count(), 1)
+        self.assertIsInstance(matching.get_engine(), matching.SerialMatchingEngine)
+
+
+class MatchQueryTest(MatchSetup):
+    def test_sweep_is_a_single_query(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test1")
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user3, "test2")
+        with self.assertNumQueries(1):
+            matches = MatchingApi.find_matches("test1")
+        self.assertEqual(matches, [])
+
+    def test_owners_are_loaded_with_candidates(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        matches = MatchingApi.find_matches("test1")
+        with self.assertNumQueries(0):
+            owners = {match.report.owner for match in matches}
+        self.assertEqual(owners, {self.user1, self.user2})
+
+    def test_report_records_are_not_loaded(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        for match in MatchingApi.find_matches("test1"):
+            self.assertEqual(
+                match.report.get_deferred_fields(), {"encrypted", "encrypted_eval"}
+            )
+
+    @override_settings(MATCHING_WORKERS=2)
+    def test_parallel_engine_streams_in_chunks(self):
+        for user in [self.user1, self.user2, self.user3, self.user4]:
+            self.create_match_report(user, "test1")
+        engine = matching.ProcessPoolMatchingEngine(2)
+        engine.chunk_size = 1
+        match_reports = MatchReport.objects.order_by("pk").iterator(chunk_size=1)
+        matches = engine.decryptable(match_reports, "test1")
+        self.assertEqual(
+            [match.pk for match in matches],
+            list(MatchReport.objects.order_by("pk").values_list("pk", flat=True)),
+        )
+        self.assertEqual(engine.rows_scanned, 4)
+
+
+class MatchFoundUpdateTest(MatchSetup):
+    def sweep_queries(self, users):
+        for user in users:
+            self.create_match_report(user, "test1")
+        Report.objects.update(match_found=False)
+        with CaptureQueriesContext(connection) as queries:
+            MatchingApi.find_matches("test1")
+        return len(queries)
+
+    def test_match_found_is_set_in_constant_queries(self):
+        two = self.sweep_queries([self.user1, self.user2])
+        four = self.sweep_queries([self.user3, self.user4])
+        self.assertEqual(two, four)
+        self.assert_matches_found_true()
+
+    def test_match_found_is_set_on_returned_reports(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        matches = MatchingApi.find_matches("test1")
+        with self.assertNumQueries(0):
+            self.assertTrue(all(match.report.match_found for match in matches))
+
+    def test_match_found_is_batched(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        self.create_match_report(self.user3, "test1")
+        with patch.object(CustomMatchingApi, "update_batch_size", 2), patch.object(
+            QuerySet, "update", autospec=True, side_effect=QuerySet.update
+        ) as update:
+            MatchingApi.find_matches("test1")
+        self.assertEqual(update.call_count, 2)
+        self.assert_matches_found_true()
+
+    def test_match_found_without_a_query_per_row(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test1")
+        with self.assertNumQueries(1):
+            match_found = [
+                match.match_found for match in MatchReport.objects.with_match_found()
+            ]
+        self.assertEqual(match_found, [True, True])
+
+
+class RehashTest(MatchSetup):
+    def create_legacy_match_report(self, user, identifier):
+        legacy_match_report = LegacyMatchReportData()
+        legacy_match_report.encrypt_match_report("legacy match report", identifier)
+        match_report = self.create_match_report(user, identifier)
+        match_report.encode_prefix = ""
+        match_report.salt = legacy_match_report.salt
+        match_report.encrypted = legacy_match_report.encrypted
+        match_report.save()
+        return match_report
+
+    def test_legacy_match_reports_are_rehashed(self):
+        match_report = self.create_legacy_match_report(self.user1, "test1")
+        self.assertEqual(MatchReport.objects.legacy().count(), 1)
+        MatchingApi.find_matches("test1")
+        match_report.refresh_from_db()
+        self.assertEqual(MatchReport.objects.legacy().count(), 0)
+        self.assertIsNone(match_report.salt)
+        self.assertTrue(match_report.encode_prefix.startswith(hashers.current_prefix()))
+        self.assertEqual(
+            MatchReport.objects.get().get_match("test1"), "legacy match report"
+        )
+
+    def test_outdated_parameters_are_rehashed(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test2")
+        with override_settings(ARGON2_TIME_COST=3):
+            self.assertEqual(MatchReport.objects.legacy().count(), 2)
+            MatchingApi.find_matches("test1")
+            self.assertEqual(MatchReport.objects.legacy().count(), 1)
+            self.assertIsNotNone(MatchReport.objects.first().get_match("test1"))
+
+    def test_current_match_reports_are_not_rehashed(self):
+        self.create_match_report(self.user1, "test1")
+        with patch.object(MatchReport, "encrypt_match_report") as encrypt:
+            MatchingApi.find_matches("test1")
+        encrypt.assert_not_called()
+
+    def test_legacy_count_is_not_queried_while_matching(self):
+        self.create_legacy_match_report(self.user1, "test1")
+        with patch.object(QuerySet, "count") as count:
+            MatchingApi.find_matches("test1")
+        count.assert_not_called()
+
+    def test_legacy_match_reports_command(self):
+        self.create_legacy_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        stdout = StringIO()
+        call_command("legacy_match_reports", stdout=stdout)
+        self.assertIn("1 of 2 match reports are legacy", stdout.getvalue())
+
+    def test_rehashed_match_reports_still_match(self):
+        self.create_legacy_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        self.assertEqual(len(MatchingApi.find_matches("test1")), 2)
+
+
+@override_settings(
+    CALLISTO_MATCHING_API="callisto_core.reporting.api.DistributedMatchingApi",
+    MATCHING_SHARD_SIZE=2,
+)
+class DistributedMatchingTest(MatchSetup):
+    def create_match_reports(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test2")
+        self.create_match_report(self.user3, "test1")
+        self.create_match_report(self.user4, "test2")
+        self.create_match_report(self.user1, "test1")
+
+    def test_same_matches_as_one_process(self):
+        self.create_match_reports()
+        identifiers = ["test1", "test2", "test3"]
+        distributed = MatchingApi.find_matches_many(identifiers)
+        Report.objects.update(match_found=False)
+        with override_settings(
+            CALLISTO_MATCHING_API="callisto_core.tests.utils.api.CustomMatchingApi"
+        ):
+            one_process = MatchingApi.find_matches_many(identifiers)
+        self.assertEqual(self.match_pks(distributed), self.match_pks(one_process))
+        self.assertEqual(len(distributed["test1"]), 2)
+        self.assertEqual(len(distributed["test2"]), 2)
+
+    def test_matches_span_shards(self):
+        self.create_match_reports()
+        with patch.object(
+            DistributedMatchingApi,
+            "match_shard",
+            autospec=True,
+            side_effect=DistributedMatchingApi.match_shard,
+        ) as shard:
+            matches = MatchingApi.find_matches_many(["test1", "test2"])["test2"]
+        self.assertEqual(shard.call_count, 3)
+        self.assertEqual(
+            {match.report.owner for match in matches}, {self.user2, self.user4}
+        )
+        self.assertTrue(all(match.match_found for match in matches))
+
+    def test_job_records_rows_scanned(self):
+        self.create_match_reports()
+        job = MatchingJob(report=self.most_recent_report)
+        job.set_identifiers(["test1"])
+        job.save()
+        with patch.object(CustomNotificationApi, "send"):
+            tasks.RunMatchingJob.delay(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MatchingJob.DONE)
+        self.assertEqual(job.matches_found, 2)
+        self.assertEqual(
+            job.rows_scanned, MatchReport.objects.in_bucket("test1").count()
+        )
+
+    def test_job_notifies_without_stretching_again(self):
+        self.create_match_reports()
+        job = MatchingJob(report=self.most_recent_report)
+        job.set_identifiers(["test1"])
+        job.save()
+        with patch.object(CustomNotificationApi, "send") as send, patch.object(
+            security, "decrypt_with_identifier"
+        ) as decrypt:
+            tasks.RunMatchingJob.delay(job.id)
+        self.assertTrue(send.called)
+        decrypt.assert_not_called()
+
+    def test_job_fails_when_collecting_fails(self):
+        self.create_match_reports()
+        job = MatchingJob(report=self.most_recent_report)
+        job.set_identifiers(["test1"])
+        job.save()
+        with patch.object(DistributedMatchingApi, "_collect", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                MatchingApi.collect_shards([], seal_identifiers(["test1"]), job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MatchingJob.FAILED)
+
+    def test_failed_shard_fails_job(self):
+        self.create_match_reports()
+        job = MatchingJob(report=self.most_recent_report)
+        job.set_identifiers(["test1"])
+        job.save()
+        tasks.FailMatchingJob.delay(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MatchingJob.FAILED)
+
+    def test_no_match_reports(self):
+        self.assertEqual(MatchingApi.find_matches("test1"), [])
+
+    def test_job_without_match_reports(self):
+        self.create_match_report(self.user1, "test1")
+        MatchReport.objects.all().delete()
+        job = MatchingJob(report=self.most_recent_report)
+        job.set_identifiers(["test1"])
+        job.save()
+        tasks.RunMatchingJob.delay(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MatchingJob.DONE)
+        self.assertEqual(job.rows_scanned, 0)
+
+    def test_identifiers_are_sealed(self):
+        sealed = seal_identifiers(["test1", "test2"])
+        self.assertNotIn("test1", sealed)
+        self.assertEqual(unseal_identifiers(sealed), ["test1", "test2"])
+
+
+class MultipleIdentifierMatchingTest(MatchSetup):
+    def create_match_reports(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test2")
+        self.create_match_report(self.user3, "test3")
+        self.create_match_report(self.user4, "test2")
+        self.create_match_report(self.user1, "test3")
+
+    def test_matches_returned_per_identifier(self):
+        self.create_match_reports()
+        matches = MatchingApi.find_matches_many(["test1", "test2", "test3"])
+        self.assertEqual(matches["test1"], [])
+        self.assertEqual(len(matches["test2"]), 2)
+        self.assertEqual(len(matches["test3"]), 2)
+        self.assertEqual(
+            {match.report.owner for match in matches["test2"]}, {self.user2, self.user4}
+        )
+
+    def test_same_results_as_one_identifier_at_a_time(self):
+        self.create_match_reports()
+        identifiers = ["test1", "test2", "test3"]
+        matches = MatchingApi.find_matches_many(identifiers)
+        Report.objects.update(match_found=False)
+        one_at_a_time = {
+            identifier: MatchingApi.find_matches(identifier)
+            for identifier in identifiers
+        }
+        self.assertEqual(self.match_pks(matches), self.match_pks(one_at_a_time))
+
+    @override_settings(MATCH_BUCKET_LENGTH=0)
+    def test_table_is_unpeppered_once(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test2")
+        self.create_match(self.user3, "test3")
+        with patch.object(
+            security, "unpepper", side_effect=security.unpepper
+        ) as unpepper:
+            MatchingApi.find_matches_many(["test1", "test2", "test3", "test4"])
+        self.assertEqual(unpepper.call_count, 3)
+
+    def test_duplicate_identifiers_are_tried_once(self):
+        self.create_match(self.user1, "test1")
+        self.create_match(self.user2, "test1")
+        matches = MatchingApi.find_matches_many(["test1", "test1"])
+        self.assertEqual(list(matches), ["test1"])
+
+
+@override_settings(MATCHING_WATERMARKS=True, MATCHING_WATERMARK_OVERLAP=0)
+class MatchingWatermarkTest(MatchSetup):
+    def test_repeat_sweep_only_tries_new_match_reports(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test2")
+        MatchingApi.find_matches("test1")
+        self.create_match_report(self.user3, "test1")
+        with patch.object(
+            security,
+            "decrypt_with_identifiers",
+            side_effect=security.decrypt_with_identifiers,
+        ) as decrypt:
+            matches = MatchingApi.find_matches("test1")
+        self.assertEqual(decrypt.call_count, 1)
+        self.assertEqual(
+            {match.report.owner for match in matches}, {self.user1, self.user3}
+        )
+
+    def test_same_matches_as_without_watermarks(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test2")
+        MatchingApi.find_matches_many(["test1", "test2"])
+        self.create_match_report(self.user3, "test1")
+        self.create_match_report(self.user4, "test2")
+        Report.objects.update(match_found=False)
+        with_watermarks = MatchingApi.find_matches_many(["test1", "test2"])
+        Report.objects.update(match_found=False)
+        with override_settings(MATCHING_WATERMARKS=False):
+            without_watermarks = MatchingApi.find_matches_many(["test1", "test2"])
+        self.assertEqual(with_watermarks, without_watermarks)
+        self.assertEqual(len(with_watermarks["test1"]), 2)
+
+    def test_watermark_records_candidates(self):
+        match_report = self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test2")
+        MatchingApi.find_matches("test1")
+        watermark = MatchingWatermark.objects.get()
+        self.assertEqual(watermark.last_swept_id, match_report.pk)
+        self.assertEqual(watermark.get_candidate_ids("test1"), [match_report.pk])
+        self.assertNotIn(b"test1", bytes(watermark.encrypted_candidates))
+
+    @override_settings(MATCHING_WATERMARK_OVERLAP=300)
+    def test_recent_match_reports_are_swept_again(self):
+        self.create_match_report(self.user1, "test1")
+        MatchingApi.find_matches("test1")
+        watermark = MatchingWatermark.objects.get()
+        self.assertEqual(watermark.last_swept_id, 0)
+        self.assertEqual(watermark.get_candidate_ids("test1"), [])
+
+    def test_deleted_match_reports_are_dropped(self):
+        match_report = self.create_match_report(self.user1, "test1")
+        MatchingApi.find_matches("test1")
+        match_report.report.delete()
+        self.create_match_report(self.user2, "test1")
+        self.assertEqual(MatchingApi.find_matches("test1"), [])
+        watermark = MatchingWatermark.objects.get()
+        self.assertEqual(
+            watermark.get_candidate_ids("test1"), [MatchReport.objects.get().pk]
+        )
+
+
+class MatchingJobTest(MatchSetup):
+    def create_job(self, identifiers):
+        job = MatchingJob(report=self.most_recent_report, site_id=1)
+        job.set_identifiers(identifiers)
+        job.save()
+        return job
+
+    def test_job_records_sweep(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test2")
+        self.create_match_report(self.user3, "test1")
+        job = self.create_job(["test1"])
+        with patch.object(CustomNotificationApi, "send"):
+            tasks.RunMatchingJob.delay(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MatchingJob.DONE)
+        self.assertEqual(job.matches_found, 2)
+        self.assertGreaterEqual(job.rows_scanned, 2)
+        self.assertIsNotNone(job.duration)
+        self.assert_matches_found_true_for("test1")
+
+    def test_identifiers_are_cleared_after_run(self):
+        self.create_match_report(self.user1, "test1")
+        job = self.create_job(["test1"])
+        self.assertEqual(job.get_identifiers(), ["test1"])
+        tasks.RunMatchingJob.delay(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.get_identifiers(), [])
+
+    def test_matches_are_notified(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        job = self.create_job(["test1"])
+        with patch.object(
+            CustomNotificationApi, "send_matching_report_to_authority"
+        ) as authority, patch.object(
+            CustomNotificationApi, "send_match_notification"
+        ) as owners, patch.object(
+            CustomNotificationApi, "send"
+        ):
+            tasks.RunMatchingJob.delay(job.id)
+        self.assertEqual(authority.call_count, 1)
+        self.assertEqual(authority.call_args[1]["identifier"], "test1")
+        self.assertEqual(owners.call_count, 2)
+
+    def test_job_is_enqueued_after_commit(self):
+        self.create_match_report(self.user1, "test1")
+
+        class MatchingView(view_partials.OptionalMatchingPartial):
+            report = self.most_recent_report
+            site_id = 1
+
+        view = MatchingView()
+        with patch.object(transaction, "on_commit") as on_commit, patch.object(
+            tasks.RunMatchingJob, "delay"
+        ) as delay:
+            view._enqueue_matching_job(["test1"])
+            self.assertFalse(delay.called)
+            on_commit.call_args[0][0]()
+        delay.assert_called_once_with(MatchingJob.objects.get().id, "")
+
+    def test_expire_matching_jobs_command(self):
+        self.create_match_report(self.user1, "test1")
+        lost_job = self.create_job(["test1"])
+        new_job = self.create_job(["test1"])
+        MatchingJob.objects.filter(pk=lost_job.pk).update(
+            created=timezone.now() - timedelta(hours=25)
+        )
+        stdout = StringIO()
+        call_command("expire_matching_jobs", stdout=stdout)
+        self.assertIn("expired 1 matching jobs", stdout.getvalue())
+        lost_job.refresh_from_db()
+        new_job.refresh_from_db()
+        self.assertEqual(lost_job.status, MatchingJob.FAILED)
+        self.assertEqual(lost_job.get_identifiers(), [])
+        self.assertEqual(new_job.status, MatchingJob.PENDING)
+        self.assertEqual(new_job.get_identifiers(), ["test1"])
+
+    def test_removed_notification_hooks_raise(self):
+        with self.assertRaises(TypeError):
+
+            class MatchingView(view_partials.OptionalMatchingPartial):
+                def _notify_owners_of_matches(self, matches):
+                    pass
+
+    def test_failed_job_is_recorded(self):
+        self.create_match_report(self.user1, "test1")
+        job = self.create_job(["test1"])
+        with patch.object(
+            CustomMatchingApi, "find_matches_many", side_effect=ValueError
+        ), self.assertRaises(ValueError):
+            tasks.RunMatchingJob(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, MatchingJob.FAILED)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(job.get_identifiers(), [])
+
+
 @skip("disabled for 2019 summer maintenance - record creation is no longer supported")
 class MatchNotificationTest(MatchSetup):
     @skip("notification mechanics moved to view partials")
@@ -4,14 +4,20 @@ from unittest import skip
 import PyPDF2
 from mock import patch
 
+from callisto_core.delivery import security
 from callisto_core.delivery.models import MatchReport
 from callisto_core.notification.management.commands.user_review_email import (
     UserReviewCommandBackend,
 )
-from callisto_core.reporting.report_delivery import PDFUserReviewReport, report_as_pdf
+from callisto_core.reporting.report_delivery import (
+    PDFMatchReport,
+    PDFUserReviewReport,
+    report_as_pdf,
+)
 from callisto_core.tests import test_base
 from callisto_core.tests.reporting.base import MatchSetup
 from callisto_core.tests.utils.api import CustomNotificationApi
+from callisto_core.utils.api import MatchingApi
 
 # TODO: generate mock_report_data in wizard builder
 mock_report_data = [
@@ -127,6 +133,34 @@ class MatchingUserReviewPDFTest(MatchSetup):
             dst_pdf.write(_file)
 
 
+class MatchReportPDFTest(MatchSetup):
+    def test_matches_are_not_decrypted_again(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        matches = MatchingApi.find_matches("test1")
+        with patch.object(security, "decrypt_with_identifiers") as decrypt:
+            pdf = PDFMatchReport(matches, "test1").generate_match_report(
+                report_id="test", recipient="test@example.com"
+            )
+        decrypt.assert_not_called()
+        pdf_reader = PyPDF2.PdfFileReader(BytesIO(pdf))
+        self.assertIn("test1", pdf_reader.getPage(1).extractText())
+
+    def test_match_reports_from_the_database_are_decrypted(self):
+        self.create_match_report(self.user1, "test1")
+        self.create_match_report(self.user2, "test1")
+        matches = list(MatchReport.objects.all())
+        with patch.object(
+            security,
+            "decrypt_with_identifiers",
+            side_effect=security.decrypt_with_identifiers,
+        ) as decrypt:
+            PDFMatchReport(matches, "test1").generate_match_report(
+                report_id="test", recipient="test@example.com"
+            )
+        self.assertEqual(decrypt.call_count, 2)
+
+
 @skip("disabled for 2019 summer maintenance - record creation is no longer supported")
 class ManagementCommandTest(MatchSetup):
     def test_action_logged(self):
@@ -1,12 +1,14 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.test import TestCase
 from django.urls import reverse
 
 from callisto_core.accounts.models import Account
 from callisto_core.delivery import models
 from callisto_core.notification.models import EmailNotification
+from callisto_core.wizard_builder import managers
 
 User = get_user_model()
 
@@ -200,6 +202,9 @@ class ReportFlowHelper(TestCase, ReportPostHelper, ReportAssertionHelper):
         return self.report.decrypt_record(self.passphrase)
 
     def setUp(self):
+        # form data is cached across tests, and fixtures may have changed it
+        cache.clear()
+        managers._local_form_data.clear()
         self._setup_sites()
         self._setup_user()
 
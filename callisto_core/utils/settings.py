@@ -20,6 +20,7 @@ def load_file(path):
         data = file_data.read()
     return data
 
+
 CALLISTO_API_ENDPOINT = "callisto_core.tests.utils.api"
 CALLISTO_EVAL_PUBLIC_KEY = load_file("callisto_publickey.gpg")
 CALLISTO_MATCHING_API = "callisto_core.tests.utils.api.CustomMatchingApi"
@@ -73,6 +74,23 @@ ARGON2_TIME_COST = 2
 ARGON2_MEM_COST = 512
 ARGON2_PARALLELISM = 2
 PEPPER = os.urandom(32)
+MATCH_BUCKET_LENGTH = 2
+MATCHING_WORKERS = 1
+MATCHING_MEMORY_BUDGET = None
+MATCHING_CHUNK_SIZE = 2000
+MATCHING_WATERMARKS = False
+MATCHING_WATERMARK_OVERLAP = 300
+MATCHING_SHARD_SIZE = 10000
+MATCHING_JOB_EXPIRY_HOURS = 24
+KDF_WORKERS = 4
+KDF_QUEUE_DEPTH = 16
+KDF_MEMORY_BUDGET = None
+KDF_RETRY_AFTER = 5
+RECORD_CODEC = "json"
+RECORD_COMPRESSION = "zlib"
+RECORD_COMPACTION_DELTAS = 20
+# seconds, edits to forms only reach every process at once with a shared cache
+FORM_SCHEMA_CACHE_TIMEOUT = 300
 DECRYPT_THROTTLE_RATE = "100/m"
 PASSWORD_MINIMUM_ENTROPY = 35
 
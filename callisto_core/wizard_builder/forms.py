@@ -1,3 +1,8 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
 from django import forms
 from django.contrib.auth import get_user_model
 
@@ -5,18 +10,48 @@ from . import widgets
 
 User = get_user_model()
 
+PAGE_FORM_CLASS_CACHE_SIZE = 256
+
+# (form class, page schema digest) => form class with the page's fields
+_page_form_classes = OrderedDict()
+_page_form_classes_lock = threading.Lock()
+
 
 class PageForm(forms.Form):
     @classmethod
     def setup(cls, page, data):
-        cls.base_fields = {
-            question.field_id: question.make_field() for question in page.mock_questions
-        }
-        self = cls(data)
+        self = cls.for_page(page)(data)
         self.page = page
         self.full_clean()
         return self
 
+    @classmethod
+    def for_page(cls, page):
+        """
+        A subclass with a field for each of the page's questions. Subclasses
+        are built once per page schema, and the most recently used are
+        kept, so fields aren't rebuilt on every request.
+        """
+        schema = json.dumps(
+            [question.serialized for question in page.mock_questions], sort_keys=True
+        )
+        key = (cls, hashlib.sha256(schema.encode("utf-8")).hexdigest())
+        with _page_form_classes_lock:
+            if key in _page_form_classes:
+                _page_form_classes.move_to_end(key)
+                return _page_form_classes[key]
+        page_fields = {
+            question.field_id: question.make_field() for question in page.mock_questions
+        }
+        page_form_class = type(cls)(
+            cls.__name__, (cls,), dict(page_fields, __module__=cls.__module__)
+        )
+        with _page_form_classes_lock:
+            _page_form_classes[key] = page_form_class
+            if len(_page_form_classes) > PAGE_FORM_CLASS_CACHE_SIZE:
+                _page_form_classes.popitem(last=False)
+        return page_form_class
+
     @property
     def sections(self):
         from .models import Page
@@ -1,6 +1,12 @@
+import json
 import logging
+import time
+from collections.abc import Sequence
 
+from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db.models import Prefetch
 from django.db.models.manager import Manager
 from django.db.models.query import QuerySet
 
@@ -8,11 +14,59 @@ from . import forms, mocks, models
 
 logger = logging.getLogger(__name__)
 
+FORM_SCHEMA_VERSION_KEY = "wizard_builder.form_schema.version"
+
+# site id => (schema version, form data as json)
+_local_form_data = {}
+
+
+def form_schema_version():
+    """
+    The version of the form schema across all sites, see
+    bump_form_schema_version
+
+    Versions start at the current time in microseconds, so a version lost
+    from the cache never restarts at a number that was already used.
+    Versions expire after FORM_SCHEMA_CACHE_TIMEOUT seconds, which bounds
+    how stale a process can be when the cache isn't shared
+    """
+    version = cache.get(FORM_SCHEMA_VERSION_KEY)
+    if version is None:
+        cache.add(
+            FORM_SCHEMA_VERSION_KEY, int(time.time() * 1e6), form_schema_cache_timeout()
+        )
+        version = cache.get(FORM_SCHEMA_VERSION_KEY)
+    return version
+
+
+def form_schema_cache_timeout():
+    return getattr(settings, "FORM_SCHEMA_CACHE_TIMEOUT", 300)
+
+
+def bump_form_schema_version():
+    """invalidates every site's cached form data"""
+    try:
+        cache.incr(FORM_SCHEMA_VERSION_KEY)
+    except ValueError:
+        pass  # no version yet, the next read starts a new one
+
 
 class FormManager(object):
+    """
+    Form data for each site is cached against the form schema version, in
+    Django's cache and again in process memory. The version lives in
+    Django's cache, so a cache shared between processes (memcached, redis,
+    etc) is required for edits in the admin to reach every process at once.
+    With the default per process cache, other processes serve the old forms
+    until their version expires, see FORM_SCHEMA_CACHE_TIMEOUT.
+    """
+
     @classmethod
     def get_serialized_forms(cls, site_id=1):
-        return [form.serialized for form in cls.get_form_models(site_id=site_id)]
+        # the same as each form's serialized, without building the forms
+        self = cls()
+        self.site_id = site_id
+        return self._get_form_data()
 
     @classmethod
     def get_form_models(cls, form_data={}, answer_data={}, site_id=1):
@@ -21,30 +75,79 @@ class FormManager(object):
         self.answer_data = answer_data
         self.form_data = form_data
         if not form_data:
-            self.form_data = self._get_form_data_from_db()
-        return self._create_forms_via_data()
+            self.form_data = self._get_form_data()
+        return PageFormSequence(self.form_data, self.answer_data)
+
+    def _get_form_data(self):
+        version = form_schema_version()
+        local_version, form_json = _local_form_data.get(self.site_id, (None, None))
+        if local_version != version:
+            cache_key = "wizard_builder.form_schema.{}.{}".format(self.site_id, version)
+            form_json = cache.get(cache_key)
+            if form_json is None:
+                form_json = json.dumps(self._get_form_data_from_db())
+                cache.set(cache_key, form_json, form_schema_cache_timeout())
+            _local_form_data[self.site_id] = (version, form_json)
+        # a fresh copy per call, since callers are free to change it
+        return json.loads(form_json)
 
     def _get_form_data_from_db(self):
+        pages = models.Page.objects.on_site(self.site_id).prefetch_site_questions(
+            self.site_id
+        )
         return [
-            [question.serialized for question in page.site_questions(self.site_id)]
-            for page in models.Page.objects.on_site(self.site_id)
+            [question.serialized for question in page.prefetched_site_questions]
+            for page in pages
         ]
 
-    def _create_forms_via_data(self):
-        return [
-            forms.PageForm.setup(page, self.answer_data)
-            for page in self._pages_via_form_data()
-        ]
 
-    def _pages_via_form_data(self):
-        pages = []
-        for page_questions in self.form_data:
-            page = mocks.MockPage(page_questions)
-            pages.append(page)
-        return pages
+class PageFormSequence(Sequence):
+    """
+    The PageForm for each page of form data. Each form is built the first
+    time it's indexed, and the length comes from the form data alone, so
+    a request only pays for the pages it uses.
+    """
+
+    def __init__(self, form_data, answer_data):
+        self.form_data = form_data
+        self.answer_data = answer_data
+        self._forms = {}
+
+    def __len__(self):
+        return len(self.form_data)
 
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page form index out of range")
+        if index not in self._forms:
+            page = mocks.MockPage(self.form_data[index])
+            self._forms[index] = forms.PageForm.setup(page, self.answer_data)
+        return self._forms[index]
 
-class PageQuerySet(QuerySet):
+
+class FormSchemaQuerySet(QuerySet):
+    """
+    Bumps the form schema version on bulk writes, which skip the
+    post_save signal that bumps it for single saves (see
+    models.form_schema_changed). bulk_update writes through update
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        bump_form_schema_version()
+        return rows
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        bump_form_schema_version()
+        return objs
+
+
+class PageQuerySet(FormSchemaQuerySet):
     def on_site(self, site_id=None):
         try:
             site_id = site_id or Site.objects.get_current().id
@@ -52,6 +155,24 @@ class PageQuerySet(QuerySet):
             site_id = 1
         return self.filter(formquestion__sites__id__in=[site_id]).distinct()
 
+    def prefetch_site_questions(self, site_id):
+        """
+        Prefetches each page's site_questions as page.prefetched_site_questions,
+        along with everything FormQuestion.serialized reads. The number of
+        queries is fixed, however many questions and choices there are.
+        """
+        choices = models.Choice.objects.prefetch_related("choiceoption_set")
+        questions = models.FormQuestion.objects.filter(
+            sites__id__in=[site_id]
+        ).prefetch_related("sites", Prefetch("choice_set", queryset=choices))
+        return self.prefetch_related(
+            Prefetch(
+                "formquestion_set",
+                queryset=questions,
+                to_attr="prefetched_site_questions",
+            )
+        )
+
 
 class PageManager(Manager):
     _queryset_class = PageQuerySet
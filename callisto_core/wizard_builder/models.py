@@ -2,6 +2,8 @@ import logging
 
 from django.contrib.sites.models import Site
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.forms.models import model_to_dict
 
 from . import fields, managers, model_helpers
@@ -71,6 +73,8 @@ class FormQuestion(models.Model):
         choices=fields.get_field_options(), null=True, default="singlelinetext"
     )
 
+    objects = managers.FormSchemaQuerySet.as_manager()
+
     def __str__(self):
         type_str = "(Type: {})".format(str(type(self).__name__))
         site_str = "(Sites: {})".format([site.name for site in self.sites.all()])
@@ -149,6 +153,8 @@ class Choice(models.Model):
     position = models.PositiveSmallIntegerField("Position", default=0)
     extra_info_text = models.TextField(blank=True, null=True)
 
+    objects = managers.FormSchemaQuerySet.as_manager()
+
     @property
     def data(self):
         data = model_to_dict(self)
@@ -170,3 +176,47 @@ class Choice(models.Model):
 class ChoiceOption(models.Model):
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     text = models.TextField(blank=False)
+
+    objects = managers.FormSchemaQuerySet.as_manager()
+
+
+# proxies, like SingleLineText, send signals as themselves
+FORM_SCHEMA_MODELS = [
+    Page,
+    FormQuestion,
+    SingleLineText,
+    TextArea,
+    MultipleChoice,
+    Checkbox,
+    RadioButton,
+    Dropdown,
+    Choice,
+    ChoiceOption,
+]
+
+
+def form_schema_changed(sender, **kwargs):
+    managers.bump_form_schema_version()
+
+
+for form_schema_model in FORM_SCHEMA_MODELS:
+    post_save.connect(
+        form_schema_changed,
+        sender=form_schema_model,
+        dispatch_uid="wizard_builder_form_schema_save",
+    )
+    post_delete.connect(
+        form_schema_changed,
+        sender=form_schema_model,
+        dispatch_uid="wizard_builder_form_schema_delete",
+    )
+
+
+@receiver(
+    m2m_changed,
+    sender=FormQuestion.sites.through,
+    dispatch_uid="wizard_builder_form_schema_sites",
+)
+def form_schema_sites_changed(sender, action, **kwargs):
+    if action.startswith("post_"):
+        managers.bump_form_schema_version()
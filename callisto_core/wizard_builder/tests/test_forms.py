@@ -38,3 +38,42 @@ class FormSerializationTest(TestCase):
         for index, expected_question in enumerate(expected_data):
             actual_question = actual_data[index]
             self.assertEqual(actual_question, expected_question)
+
+
+class PageFormClassTest(TestCase):
+    question = {
+        "id": 5,
+        "question_text": "where did it happen?",
+        "type": "singlelinetext",
+        "section": 1,
+    }
+
+    def page(self, **changes):
+        return mocks.MockPage([dict(self.question, **changes)])
+
+    def test_page_fields(self):
+        form = forms.PageForm.setup(self.page(), {"question_5": "outside"})
+        self.assertEqual(list(form.fields), ["question_5"])
+        self.assertEqual(form.cleaned_data, {"question_5": "outside"})
+
+    def test_shared_class_not_changed(self):
+        forms.PageForm.setup(self.page(), {})
+        self.assertEqual(forms.PageForm.base_fields, {})
+
+    def test_class_reused_for_same_schema(self):
+        self.assertIs(
+            forms.PageForm.for_page(self.page()), forms.PageForm.for_page(self.page())
+        )
+
+    def test_class_rebuilt_for_changed_schema(self):
+        self.assertIsNot(
+            forms.PageForm.for_page(self.page()),
+            forms.PageForm.for_page(self.page(question_text="when did it happen?")),
+        )
+
+    def test_cache_is_bounded(self):
+        for index in range(forms.PAGE_FORM_CLASS_CACHE_SIZE + 10):
+            forms.PageForm.for_page(self.page(id=index))
+        self.assertEqual(
+            len(forms._page_form_classes), forms.PAGE_FORM_CLASS_CACHE_SIZE
+        )
@@ -1,5 +1,8 @@
+from unittest.mock import patch
+
 from django.contrib.sites.models import Site
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
 from callisto_core.wizard_builder import forms, managers, models
 
@@ -57,3 +60,144 @@ class ManagerTest(TestCase):
         self.assertGreater(
             len(page.formquestion_set.all()), len(previous_all_questions)
         )
+
+
+class FormSchemaCacheTest(TestCase):
+    manager = managers.FormManager
+    fixtures = ["wizard_builder_data"]
+
+    def setUp(self):
+        cache.clear()
+        managers._local_form_data.clear()
+
+    def test_serialized_forms_cached(self):
+        forms_before = self.manager.get_serialized_forms()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.manager.get_serialized_forms(), forms_before)
+
+    def test_cache_copies_are_independent(self):
+        self.manager.get_serialized_forms()[0].append("changed")
+        self.assertNotIn("changed", self.manager.get_serialized_forms()[0])
+
+    def test_question_edit_invalidates_cache(self):
+        self.manager.get_serialized_forms()
+        question = models.FormQuestion.objects.first()
+        question.text = "a new question"
+        question.save()
+        self.assertIn(
+            "a new question",
+            [
+                question["question_text"]
+                for page in self.manager.get_serialized_forms()
+                for question in page
+            ],
+        )
+
+    def test_choice_option_delete_invalidates_cache(self):
+        self.manager.get_serialized_forms()
+        models.ChoiceOption.objects.all().delete()
+        for page in self.manager.get_serialized_forms():
+            for question in page:
+                for choice in question["choices"]:
+                    self.assertEqual(choice["options"], [])
+
+    def test_question_update_invalidates_cache(self):
+        self.manager.get_serialized_forms()
+        models.FormQuestion.objects.update(text="an updated question")
+        for page in self.manager.get_serialized_forms():
+            for question in page:
+                self.assertEqual(question["question_text"], "an updated question")
+
+    def test_choice_bulk_create_invalidates_cache(self):
+        with patch.object(managers, "bump_form_schema_version") as bump:
+            models.Choice.objects.bulk_create(
+                [models.Choice(question=models.FormQuestion.objects.first())]
+            )
+        bump.assert_called_once_with()
+
+    def test_proxy_question_bulk_update_invalidates_cache(self):
+        questions = list(models.SingleLineText.objects.all())
+        for question in questions:
+            question.text = "a bulk updated question"
+        with patch.object(managers, "bump_form_schema_version") as bump:
+            models.SingleLineText.objects.bulk_update(questions, ["text"])
+        self.assertTrue(bump.called)
+
+    def test_unrelated_saves_keep_cache(self):
+        self.manager.get_serialized_forms()
+        with patch.object(managers, "bump_form_schema_version") as bump:
+            Site.objects.create(name="second.com", domain="second.com")
+        bump.assert_not_called()
+
+    def test_proxy_question_save_invalidates_cache(self):
+        with patch.object(managers, "bump_form_schema_version") as bump:
+            models.SingleLineText.objects.first().save()
+        bump.assert_called_once_with()
+
+    @override_settings(FORM_SCHEMA_CACHE_TIMEOUT=60)
+    def test_cache_entries_expire(self):
+        with patch.object(managers.cache, "set", wraps=managers.cache.set) as cache_set:
+            self.manager.get_serialized_forms()
+        self.assertEqual(cache_set.call_args[0][2], 60)
+
+    def test_site_change_invalidates_cache(self):
+        site = Site.objects.create(name="second.com", domain="second.com")
+        self.assertEqual(self.manager.get_serialized_forms(site_id=site.id), [])
+        models.FormQuestion.objects.first().sites.add(site)
+        self.assertEqual(len(self.manager.get_serialized_forms(site_id=site.id)), 1)
+
+
+class FormDataQueryTest(TestCase):
+    manager = managers.FormManager
+    fixtures = ["wizard_builder_data"]
+
+    def _form_data(self):
+        manager = self.manager()
+        manager.site_id = 1
+        return manager._get_form_data_from_db()
+
+    def _add_question(self):
+        page = models.Page.objects.first()
+        question = models.RadioButton.objects.create(text="a new question", page=page)
+        question.sites.add(1)
+        for text in ["yes", "no"]:
+            choice = models.Choice.objects.create(question=question, text=text)
+            models.ChoiceOption.objects.create(choice=choice, text="an option")
+
+    def test_form_data_matches_serialized_questions(self):
+        self._add_question()
+        self.assertEqual(
+            self._form_data(),
+            [
+                [question.serialized for question in page.site_questions(1)]
+                for page in models.Page.objects.on_site(1)
+            ],
+        )
+
+    def test_query_count_is_fixed(self):
+        # pages, questions, sites, choices, options
+        with self.assertNumQueries(5):
+            self._form_data()
+        for _ in range(3):
+            self._add_question()
+        with self.assertNumQueries(5):
+            self._form_data()
+
+
+class PageFormSequenceTest(TestCase):
+    manager = managers.FormManager
+    fixtures = ["wizard_builder_data"]
+
+    def test_forms_built_on_first_access(self):
+        with patch.object(forms.PageForm, "setup", wraps=forms.PageForm.setup) as setup:
+            page_forms = self.manager.get_form_models()
+            self.assertGreater(len(page_forms), 1)
+            self.assertEqual(setup.call_count, 0)
+            self.assertIs(page_forms[1], page_forms[1])
+            self.assertEqual(setup.call_count, 1)
+
+    def test_negative_and_out_of_range_indexes(self):
+        page_forms = self.manager.get_form_models()
+        self.assertIs(page_forms[-1], page_forms[len(page_forms) - 1])
+        with self.assertRaises(IndexError):
+            page_forms[len(page_forms)]
@@ -173,6 +173,11 @@ class StorageHelper(object):
         primary class functionality method, updates the data in storage
         """
         self.add_data_to_storage(self.answers_for_current_step)
+        self.invalidate()
+
+    def invalidate(self):
+        """drops any data read from storage earlier in the request"""
+        pass
 
     def current_data_from_storage(self):
         return {
@@ -24,10 +24,14 @@ from . import view_helpers
 
 class WizardFormPartial(views.edit.FormView):
     storage_helper = view_helpers.StorageHelper
+    _storage = None
 
     @property
     def storage(self):
-        return self.storage_helper(self)
+        # one helper per request, since views are built per request
+        if self._storage is None:
+            self._storage = self.storage_helper(self)
+        return self._storage
 
     def get_site_id(self):
         try:
@@ -54,10 +58,13 @@ class WizardPartial(WizardFormPartial, view_helpers.WizardViewTemplateHelpers):
     site_id = None
     url_name = None
     steps_helper = view_helpers.StepsHelper
+    _steps = None
 
     @property
     def steps(self):
-        return self.steps_helper(self)
+        if self._steps is None:
+            self._steps = self.steps_helper(self)
+        return self._steps
 
     @property
     def wizard_form(self):
@@ -56,7 +56,7 @@ setup(
        'django-widget-tweaks>=1.4',
        'django-decorator-include>=1',
        'gnupg>=2.3',
-       'PyNaCl>=1.0',
+       'PyNaCl>=1.3',
        'pytz>=2017',
        'reportlab>=3.0',
        'requests',